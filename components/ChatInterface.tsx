@@ -202,6 +202,11 @@ export function ChatInterface({
                 onConversationChange(newConversationId);
               }
             }
+          } else if (event.type === "title") {
+            // Generated title was stored in the background - refresh the sidebar
+            if (onConversationChange && event.conversation_id) {
+              onConversationChange(event.conversation_id);
+            }
           } else if (event.type === "classification") {
             queryType = event.query_type;
           } else if (event.type === "chunk") {
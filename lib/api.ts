@@ -1,6 +1,7 @@
 export interface StreamEvent {
-  type: "conversation" | "classification" | "chunk" | "validation" | "error";
+  type: "conversation" | "title" | "classification" | "chunk" | "validation" | "error";
   conversation_id?: string;
+  title?: string;
   query_type?: string;
   section?: string;
   content?: string;
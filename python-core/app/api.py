@@ -1,36 +1,39 @@
 import asyncio
 import atexit
-import json
+import contextvars
+import functools
 import logging
 import os
 import signal
-from typing import Dict
+from typing import Any, AsyncIterator, Callable, Coroutine, Dict, List, Optional, Set, Tuple
 
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import ORJSONResponse
+from sse_starlette.sse import EventSourceResponse
 
-from app.core.config import settings, MODEL_TIERS
-from app.core.prompts import THINKING_PROMPT, SIMPLE_PROMPT, CONTEXT_TEMPLATE, FACTUAL_PROMPT
+from app.core.config import get_settings, MODEL_TIERS
+from app.core.prompts import (
+    QueryType, reasoning_prompt, render_simple_prompt, render_context_block
+)
 from app.schemas import (
     ChatRequest, ApiKeyRequest, HealthResponse,
-    ConversationResponse, MessageResponse, ConversationListResponse,
-    MessageListResponse, TitleUpdateRequest, Message,
+    ConversationResponse, ConversationListResponse,
+    MessageListResponse, TitleUpdateRequest, ConversationDeleteRequest,
     MemoryCreateRequest, MemoryUpdateRequest
 )
-from app.services.llm import generate_with_thinking, generate_stream
-from app.services.memory import memory
-from app.services.router import classify_query
-from app.services.validator import validate_response
-from app.services.llm import generate_with_thinking, generate_stream
+from app.services.llm import generate_with_thinking, generate_stream_frames
 from app.services.memory import memory
-from app.services.router import classify_query
+from app.services.classify_cache import (
+    classify_uncached, get_classify_cache, lookup_cached_classification
+)
 from app.services.validator import validate_response
-from app.services.database import DatabaseService
+from app.services.database import MESSAGE_COLUMNS, DatabaseService
 from app.services.tools import tools
 from app.services.profile import profile
-from app.services.extraction import auto_extract_memory
+from app.services.extraction import schedule_extract_memory
 import litellm
+import orjson
 
 
 # Configure logging
@@ -44,6 +47,7 @@ app = FastAPI(
     title="Sigma Agent Backend",
     description="Local-first AI Agent with Reasoning",
     version="2.0.0",
+    default_response_class=ORJSONResponse,
 )
 
 # CORS for Tauri frontend
@@ -57,31 +61,108 @@ app.add_middleware(
 
 # Global state
 api_keys: Dict[str, str] = {}  # model_name -> api_key mapping
+_background_tasks: Set[asyncio.Task] = set()  # Fire-and-forget work (titles, ...)
 db = DatabaseService()  # Database service instance
 
 
+# mode -> (base model, use thinking), indexed by QueryType (SIMPLE, FACTUAL, COMPLEX)
+MODE_DISPATCH: Dict[str, Tuple[Tuple[str, bool], ...]] = {
+    "auto": (
+        (MODEL_TIERS["fast"], False),
+        (MODEL_TIERS["auto"], True),
+        (MODEL_TIERS["auto"], True),
+    ),
+    "pro": ((MODEL_TIERS["pro"], True),) * len(QueryType),
+    "fast": ((MODEL_TIERS["fast"], False),) * len(QueryType),
+}
+
+# Pre-encoded SSE frames / frame prefixes for the streaming hot path
+_SSE_DONE = b"data: [DONE]\n\n"
+_SSE_ANSWER_CHUNK_PREFIX = b'data: {"type":"chunk","section":"answer","content":'
+_SSE_CHUNK_PREFIXES = {
+    "thinking": b'data: {"type":"chunk","section":"thinking","content":',
+    "answer": _SSE_ANSWER_CHUNK_PREFIX,
+}
+_SSE_CHUNK_SUFFIX = b"}\n\n"
+_SSE_CLASSIFICATION_SIMPLE = b'data: {"type":"classification","query_type":"simple"}\n\n'
+SSE_PING_INTERVAL = 15  # seconds; keeps proxies from dropping slow generations
+
+# Constant system messages, built once and shared by every request (read-only)
+_DEFAULT_SYSTEM_MESSAGE: Dict[str, Any] = {"role": "system", "content": "You are a helpful AI assistant."}
+_SEARCH_REWRITE_SYSTEM_MESSAGE: Dict[str, Any] = {
+    "role": "system",
+    "content": "Convert the user's query to an optimal English Google search query. Return ONLY the search term, nothing else. Be concise and specific."
+}
+
+
+def _spawn(coro: Coroutine) -> asyncio.Task:
+    """Start a background task, keeping a strong reference until it finishes"""
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+async def _to_thread_fast(func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """
+    asyncio.to_thread without the context-copy wrapper when there is no context.
+
+    to_thread always runs func inside copy_context().run; with an empty context
+    that indirection buys nothing, so the function is submitted directly.
+    """
+    loop = asyncio.get_running_loop()
+    call = functools.partial(func, *args, **kwargs)
+    ctx = contextvars.copy_context()
+    if len(ctx):
+        call = functools.partial(ctx.run, call)
+    return await loop.run_in_executor(None, call)
+
+
+def _sse(payload: dict) -> bytes:
+    """Encode a payload as a single SSE data frame"""
+    return b"data: " + orjson.dumps(payload) + b"\n\n"
+
+
+def _event_source(stream: AsyncIterator[bytes]) -> EventSourceResponse:
+    """Wrap a stream of pre-encoded SSE frames in an EventSourceResponse"""
+    # Pre-encoded frames pass through untouched; EventSourceResponse adds the
+    # no-cache/no-buffering headers and keepalive pings for long generations.
+    # sep="\n" keeps pings consistent with our frames (the client splits on "\n").
+    return EventSourceResponse(stream, ping=SSE_PING_INTERVAL, sep="\n")
+
+
+class _TitleWatcher:
+    """Turns a background title-generation task into a one-shot SSE frame"""
+
+    def __init__(self, conversation_id: str, task: Optional[asyncio.Task]):
+        self.conversation_id = conversation_id
+        self.task = task
+
+    def poll(self) -> Optional[bytes]:
+        """SSE frame for the generated title, once its background task is done"""
+        task = self.task
+        if task is None or not task.done():
+            return None
+        self.task = None
+        title = None if task.cancelled() or task.exception() else task.result()
+        if not title:
+            return None
+        return _sse({"type": "title", "conversation_id": self.conversation_id, "title": title})
+
+
 def get_api_key(model: str) -> str | None:
     """
     Get API key for a model, handling both prefixed and non-prefixed model names.
     
-    This ensures compatibility with keys saved as "gemini/..." or without prefix.
+    set_api_key stores every key under both its "gemini/"-prefixed and bare
+    name, so this is a single lookup.
     """
-    # Try exact match first
-    if model in api_keys:
-        return api_keys[model]
-    
-    # Try with "gemini/" prefix if not present
-    prefixed_model = f"gemini/{model}"
-    if prefixed_model in api_keys:
-        return api_keys[prefixed_model]
-    
-    # Try without prefix if model has prefix
-    if model.startswith("gemini/"):
-        clean_model = model.replace("gemini/", "")
-        if clean_model in api_keys:
-            return api_keys[clean_model]
-    
-    return None
+    return api_keys.get(model)
+
+
+def _fallback_title(message: str) -> str:
+    """Placeholder conversation title: first 50 characters of the message"""
+    return message[:50].strip()
 
 
 async def generate_conversation_title(first_message: str, api_key: str, model: str) -> str:
@@ -116,7 +197,7 @@ async def generate_conversation_title(first_message: str, api_key: str, model: s
         content = response.choices[0].message.content
         if content is None:
             logger.warning("Title generation returned None content, using fallback")
-            return first_message[:50].strip() if len(first_message) > 50 else first_message.strip()
+            return _fallback_title(first_message)
         
         title = content.strip()
         # Ensure max 60 chars
@@ -129,7 +210,27 @@ async def generate_conversation_title(first_message: str, api_key: str, model: s
         logger.warning(f"Title generation failed: {e}, using fallback")
     
     # Fallback to first 50 chars
-    return first_message[:50].strip() if len(first_message) > 50 else first_message.strip()
+    return _fallback_title(first_message)
+
+
+async def refine_conversation_title(
+    conversation_id: str, first_message: str, api_key: str, model: str
+) -> Optional[str]:
+    """
+    Generate a title for a new conversation and store it.
+
+    Runs in the background so the chat stream isn't delayed by the title LLM call.
+
+    Returns:
+        The stored title, or None if it could not be saved
+    """
+    title = await generate_conversation_title(first_message, api_key, model)
+    try:
+        db.update_conversation_title(conversation_id, title)
+    except Exception as e:
+        logger.warning(f"Failed to store generated title for {conversation_id}: {e}")
+        return None
+    return title
 
 
 @app.on_event("startup")
@@ -137,9 +238,16 @@ async def startup():
     """Log configuration on startup"""
     logger.info(f"Loaded MODEL_TIERS: {MODEL_TIERS}")
     db.initialize()
+    get_classify_cache().attach_store(db)
     logger.info("Application startup complete")
 
 
+@app.on_event("shutdown")
+async def close_database():
+    """Close the shared database connection"""
+    db.close()
+
+
 @app.get("/health", response_model=HealthResponse)
 async def health_check() -> HealthResponse:
     """Health check endpoint"""
@@ -151,7 +259,7 @@ async def health_check() -> HealthResponse:
 
 
 @app.post("/chat")
-async def chat(request: ChatRequest) -> StreamingResponse:
+async def chat(request: ChatRequest) -> EventSourceResponse:
     """
     Main chat endpoint with intelligent routing and reasoning
 
@@ -165,45 +273,49 @@ async def chat(request: ChatRequest) -> StreamingResponse:
 
     last_message = request.messages[-1].content
 
+    # API key for router calls (classification, titles, query rewrite):
+    # the auto tier model's key, else any configured key
+    router_model = MODEL_TIERS["auto"]
+    router_api_key = get_api_key(router_model)
+    if not router_api_key and api_keys:
+        router_api_key = next(iter(api_keys.values()))
+        logger.warning(
+            f"No API key for router model '{router_model}', using fallback key"
+        )
+
     # Handle conversation management
     conversation_id = request.conversation_id
+    title_task: Optional[asyncio.Task] = None
+    history: List[Dict[str, str]] = []  # Previous turns loaded from the DB
     
     # If no conversation_id provided, create new conversation
     if not conversation_id:
-        # Generate title from first message
-        router_model = MODEL_TIERS["auto"]
-        router_api_key = get_api_key(router_model) or next(iter(api_keys.values()), None)
-        if router_api_key:
-            title = await generate_conversation_title(last_message, router_api_key, router_model)
-        else:
-            title = last_message[:50].strip() if len(last_message) > 50 else last_message.strip()
-        
-        conversation_id = db.create_conversation(title)
+        # Create with a placeholder title so streaming isn't blocked on the LLM;
+        # the generated title is stored (and pushed to the client) when ready
+        conversation_id = db.create_conversation(_fallback_title(last_message))
         logger.info(f"Created new conversation: {conversation_id}")
+
+        if router_api_key:
+            title_task = _spawn(
+                refine_conversation_title(conversation_id, last_message, router_api_key, router_model)
+            )
     else:
         # Verify conversation exists
         conversation = db.get_conversation(conversation_id)
         if not conversation:
             raise HTTPException(status_code=404, detail=f"Conversation {conversation_id} not found")
         
-        # Load previous messages from DB for context
-        db_messages = db.get_messages(conversation_id)
-        if db_messages:
-            # Prepend DB messages to request messages (excluding the last user message which is in request)
-            # Convert DB messages to Message format
-            previous_messages = [
-                {"role": msg["role"], "content": msg["content"]}
-                for msg in db_messages
-            ]
-            # Merge with request messages (request.messages already contains the new user message)
-            request.messages = [
-                Message(role=msg["role"], content=msg["content"])
-                for msg in previous_messages
-            ] + request.messages
-            logger.info(f"Loaded {len(previous_messages)} previous messages for conversation {conversation_id}")
+        # Load previous messages from DB for context; they are prepended to
+        # request.messages (which already contains the new user message)
+        history = [
+            {"role": role, "content": content}
+            for _, _, role, content, _, _ in db.iter_messages(conversation_id)
+        ]
+        if history:
+            logger.info(f"Loaded {len(history)} previous messages for conversation {conversation_id}")
 
     # Ensure at least one API key is available for router classification
-    if not api_keys:
+    if not router_api_key:
         raise HTTPException(
             status_code=401,
             detail="No API keys configured. Use /config/api-key endpoint first.",
@@ -211,41 +323,20 @@ async def chat(request: ChatRequest) -> StreamingResponse:
 
     mode = request.mode or "auto"
 
-    # Get API key for classification (use auto tier model)
-    router_model = MODEL_TIERS["auto"]
-    router_api_key = get_api_key(router_model)
-
-    if not router_api_key:
-        # Fallback to any available key
-        if api_keys:
-            router_api_key = next(iter(api_keys.values()))
-            logger.warning(
-                f"No API key for router model '{router_model}', using fallback key"
-            )
-        else:
-            raise HTTPException(
-                status_code=401,
-                detail="No API keys configured. Use /config/api-key endpoint first.",
-            )
-
-    # STEP 1: Classify query type
+    # STEP 1: Classify query type. On a cache miss the memory search is started
+    # speculatively so it overlaps the router LLM call (dropped if "simple").
     logger.info(f"Classifying query: {last_message[:50]}...")
-    query_type = await classify_query(last_message, router_api_key)
+    memory_task: Optional[asyncio.Task] = None
+    query_type, query_embedding = await lookup_cached_classification(last_message)
+    if query_type is None:
+        if get_settings().inject_context_block:
+            memory_task = asyncio.create_task(
+                _to_thread_fast(memory.search_memory, last_message, n_results=3)
+            )
+        query_type = await classify_uncached(last_message, router_api_key, query_embedding)
 
     # STEP 2: Determine base model & thinking behaviour from mode + query type
-    if mode == "auto":
-        if query_type == "simple":
-            base_model = MODEL_TIERS["fast"]
-            use_thinking = False
-        else:
-            base_model = MODEL_TIERS["auto"]
-            use_thinking = True
-    elif mode == "pro":
-        base_model = MODEL_TIERS["pro"]
-        use_thinking = True
-    else:  # fast
-        base_model = MODEL_TIERS["fast"]
-        use_thinking = False
+    base_model, use_thinking = MODE_DISPATCH[mode][query_type]
 
     # Allow explicit model override from client
     model = request.model or base_model
@@ -260,6 +351,8 @@ async def chat(request: ChatRequest) -> StreamingResponse:
     # STEP 3: Look up API key for the determined model
     api_key = get_api_key(model)
     if not api_key:
+        if memory_task is not None:
+            memory_task.cancel()  # Speculative search result won't be read
         raise HTTPException(
             status_code=401,
             detail=(
@@ -269,97 +362,30 @@ async def chat(request: ChatRequest) -> StreamingResponse:
         )
 
     # STEP 4: Build messages / context based on query type and mode
-    if query_type == "simple" and mode != "pro":
+    if query_type is QueryType.SIMPLE and mode != "pro":
         # Fast path: No memory, no thinking, use simple prompt
         logger.info("Taking SIMPLE path")
-        prompt = SIMPLE_PROMPT.format(query=last_message)
-        messages = [{"role": "user", "content": prompt}]
-        effective_use_thinking = False
-        context_block = None
+        if memory_task is not None:
+            memory_task.cancel()  # Speculative search result isn't needed
+        prompt = render_simple_prompt(query=last_message)
+        return _event_source(_simple_stream(
+            conversation_id=conversation_id,
+            title_task=title_task,
+            messages=[{"role": "user", "content": prompt}],
+            model=model,
+            api_key=api_key,
+            last_message=last_message,
+        ))
     else:
         # Complex/Factual path: Full pipeline
-        logger.info(f"Taking {query_type.upper()} path (mode={mode})")
-
-        # Search memory (run in thread to avoid blocking)
-        memory_task = asyncio.create_task(
-            asyncio.to_thread(memory.search_memory, last_message, n_results=3)
-        )
+        logger.info(f"Taking {query_type.label.upper()} path (mode={mode})")
 
-        # Search web if factual
-        search_results = ""
-        if query_type == "factual":
-            # Rewrite query to optimal English search term
-            search_query = last_message
-            try:
-                logger.info(f"Rewriting query for search: {last_message[:50]}...")
-                rewrite_response = await litellm.acompletion(
-                    model="gemini/gemini-2.0-flash",
-                    messages=[
-                        {
-                            "role": "system",
-                            "content": "Convert the user's query to an optimal English Google search query. Return ONLY the search term, nothing else. Be concise and specific."
-                        },
-                        {
-                            "role": "user",
-                            "content": last_message
-                        }
-                    ],
-                    api_key=router_api_key,
-                    custom_llm_provider="gemini",
-                    max_tokens=50,
-                    temperature=0.3,
-                )
-                
-                rewritten = rewrite_response.choices[0].message.content
-                if rewritten and rewritten.strip():
-                    search_query = rewritten.strip()
-                    logger.info(f"Rewritten search query: {search_query}")
-                else:
-                    logger.warning("Query rewrite returned empty, using original")
-            except Exception as rewrite_err:
-                logger.warning(f"Query rewrite failed: {rewrite_err}, using original query")
-            
-            # Execute search in thread to avoid blocking
-            search_task = asyncio.create_task(
-                asyncio.to_thread(tools.search_web, search_query)
+        if get_settings().inject_context_block:
+            context_block = await _build_context_block(
+                last_message, query_type, router_api_key, memory_task
             )
-            try:
-                search_results = await search_task
-                logger.info("Web search completed")
-            except Exception as e:
-                logger.error(f"Web search failed during execution: {e}")
-                search_results = f"[Error obtaining search results: {e}]"
-
-        # Wait for memory results
-        relevant_memories = await memory_task
-        memory_context = (
-            "\n".join(relevant_memories)
-            if relevant_memories
-            else "No relevant context found"
-        )
-
-        # SMART CONTEXT: Get relevant profile memories (max 300 tokens)
-        relevant_profile = await asyncio.to_thread(
-            profile.get_relevant_memories, last_message, max_results=5, max_tokens=300
-        )
-        
-        profile_context = ""
-        if relevant_profile:
-            profile_context = "\n".join([
-                f"- {m['key']}: {m['value']}" 
-                for m in relevant_profile
-            ])
-            logger.info(f"Injecting {len(relevant_profile)} profile memories")
-
-        # Build context block
-        context_block = CONTEXT_TEMPLATE.format(
-            memory_context=memory_context,
-            search_results=search_results,
-        )
-        
-        # Add profile context if available
-        if profile_context:
-            context_block += f"\n\nUSER INFO (verified facts about the user):\n{profile_context}"
+        else:
+            context_block = ""
 
         # PROMPT SELECTION STRATEGY
         is_native_reasoning = "deepseek" in model.lower() or "gemini-3-pro" in model.lower() or "r1" in model.lower()
@@ -370,54 +396,50 @@ async def chat(request: ChatRequest) -> StreamingResponse:
             logger.info(f"Using NATIVE reasoning strategy for {model}")
             
             if context_block.strip():
-                system_prompt = f"Use the following context to answer the user's question:\n\n{context_block}"
+                system_message = {
+                    "role": "system",
+                    "content": f"Use the following context to answer the user's question:\n\n{context_block}",
+                }
             else:
-                system_prompt = "You are a helpful AI assistant."
+                system_message = _DEFAULT_SYSTEM_MESSAGE
                 
         else:
             # Traditional Models (GPT-4o, Claude 3.5, etc.)
             # Strategy: Prompt Engineering (Chain of Thought via XML tags)
             logger.info(f"Using PROMPT-BASED reasoning strategy for {model}")
             
-            if query_type == "factual":
-                system_prompt = FACTUAL_PROMPT
-            else:
-                system_prompt = THINKING_PROMPT
+            base_prompt = reasoning_prompt(query_type)
             
-            # Inject context block if available
-            if context_block.strip():
-                system_prompt += f"\n\n{context_block}"
+            # Inject context block if available (after the constant prompt, so
+            # the prefix stays identical across requests for provider caching)
+            system_message = _system_message(
+                base_prompt, context_block if context_block.strip() else "", model
+            )
 
         # Construct messages
         # For DeepSeek R1, some guides suggest avoiding system prompts entirely, 
         # but we need to inject context. Putting context in user message or system message is debated.
         # We'll stick to system message for now as LiteLLM handles it.
         messages = [
-            {"role": "system", "content": system_prompt},
-            *[{"role": m.role, "content": m.content} for m in request.messages],
+            system_message,
+            *history,
+            *({"role": m.role, "content": m.content} for m in request.messages),
         ]
         effective_use_thinking = include_thinking
 
     async def event_stream():
         """SSE stream generator"""
-        thinking_content = ""
-        answer_content = ""
+        thinking_parts: List[str] = []
+        answer_parts: List[str] = []
+        titles = _TitleWatcher(conversation_id, title_task)
         
         try:
             # Send conversation_id and classification to frontend first
-            yield (
-                "data: "
-                + json.dumps({
-                    "type": "conversation",
-                    "conversation_id": conversation_id
-                })
-                + "\n\n"
-            )
-            yield (
-                "data: "
-                + json.dumps({"type": "classification", "query_type": query_type})
-                + "\n\n"
-            )
+            yield _sse({
+                "type": "conversation",
+                "conversation_id": conversation_id
+            })
+            yield _sse({"type": "classification", "query_type": query_type.label})
 
             # STEP 5: Generate response (streaming)
             logger.info(f"Generating response with model: {model}")
@@ -431,120 +453,340 @@ async def chat(request: ChatRequest) -> StreamingResponse:
                     api_key,
                     include_thinking=include_thinking,
                 ):
-                    full_response = chunk["full"]
                     section = chunk["section"]
+                    if "full" in chunk:  # Final "done" dict, or "error" with the text so far
+                        full_response = chunk["full"]
+                        if section == "done":
+                            continue
                     content = chunk["content"]
                     
                     # Track thinking and answer separately
                     if section == "thinking":
-                        thinking_content += content
+                        thinking_parts.append(content)
                     elif section == "answer":
-                        answer_content += content
+                        answer_parts.append(content)
                     
-                    yield (
-                        "data: "
-                        + json.dumps(
-                            {
-                                "type": "chunk",
-                                "section": section,
-                                "content": content,
-                            }
-                        )
-                        + "\n\n"
-                    )
+                    prefix = _SSE_CHUNK_PREFIXES.get(section)
+                    if prefix is not None:
+                        # Same bytes as _sse({...}) without building the dict
+                        yield prefix + orjson.dumps(content) + _SSE_CHUNK_SUFFIX
+                    else:
+                        yield _sse({
+                            "type": "chunk",
+                            "section": section,
+                            "content": content,
+                        })
+                    title_frame = titles.poll()
+                    if title_frame:
+                        yield title_frame
             else:
                 # Simple streaming
-                async for chunk in generate_stream(messages, model, api_key):
-                    chunk_content = chunk.get("content", "")
-                    full_response += chunk_content
-                    answer_content += chunk_content
-                    yield (
-                        "data: "
-                        + json.dumps(
-                            {
-                                "type": "chunk",
-                                "section": "answer",
-                                "content": chunk_content,
-                            }
-                        )
-                        + "\n\n"
-                    )
+                async for frame, chunk_content in generate_stream_frames(
+                    messages, model, api_key, _SSE_ANSWER_CHUNK_PREFIX, _SSE_CHUNK_SUFFIX
+                ):
+                    answer_parts.append(chunk_content)
+                    yield frame
+                    title_frame = titles.poll()
+                    if title_frame:
+                        yield title_frame
+
+            thinking_content = "".join(thinking_parts)
+            answer_content = "".join(answer_parts)
+            if not effective_use_thinking:
+                full_response = answer_content
 
             # STEP 6: Validate response
             logger.info("Validating response...")
             validation = await validate_response(full_response, query_type)
-            yield (
-                "data: "
-                + json.dumps({"type": "validation", "result": validation})
-                + "\n\n"
-            )
+            yield _sse({"type": "validation", "result": validation})
 
             # STEP 7: Save messages to database
             thinking_to_store = None
             answer_to_store = full_response.strip()
             try:
-                # Save user message
-                db.add_message(conversation_id, "user", last_message)
-                
-                # Save assistant message (with thinking if present)
+                # Save user + assistant message (with thinking if present) in one transaction
                 thinking_to_store = thinking_content.strip() if thinking_content.strip() else None
                 answer_to_store = answer_content.strip() if answer_content.strip() else full_response.strip()
-                db.add_message(
-                    conversation_id,
-                    "assistant",
-                    answer_to_store,
-                    thinking=thinking_to_store
-                )
+                db.add_messages(conversation_id, [
+                    ("user", last_message, None),
+                    ("assistant", answer_to_store, thinking_to_store),
+                ])
                 logger.info(f"Saved messages to conversation {conversation_id}")
             except Exception as db_error:
                 logger.error(f"Failed to save messages to database: {db_error}", exc_info=True)
                 # Don't fail the request, just log the error
 
-            # STEP 8: Store in memory (FOR ALL QUERIES)
-            memory_text = f"User: {last_message}\n\nAssistant: {answer_to_store}"
-            memory_id = memory.add_memory(
-                memory_text,
+            # STEP 8 + 9: Store in vector memory and auto-extract personal info,
+            # in the background so [DONE] isn't held back by the embedding pass
+            _spawn(_store_turn_memory(
+                last_message,
+                answer_to_store,
+                api_key,
                 metadata={
                     "model": model,
-                    "query_type": query_type,
+                    "query_type": query_type.label,
                     "is_valid": validation["is_valid"],
                     "conversation_id": conversation_id,
                 },
-            )
-            logger.info(f"Stored in memory: {memory_id[:8]}...")
-            
-            # STEP 9: Auto-extract personal info (ALWAYS RUN)
-            if api_key:
-                logger.info("Triggering auto-extraction...")
-                asyncio.create_task(
-                    auto_extract_memory(last_message, answer_to_store, api_key)
-                )
+            ))
 
             # Send completion signal
-            yield "data: [DONE]\n\n"
+            title_frame = titles.poll()
+            if title_frame:
+                yield title_frame
+            yield _SSE_DONE
 
         except Exception as e:
             logger.error(f"Chat error: {e}", exc_info=True)
-            yield "data: " + json.dumps({"type": "error", "message": str(e)}) + "\n\n"
-
-    return StreamingResponse(
-        event_stream(),
-        media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "X-Accel-Buffering": "no",
-        },
+            yield _sse({"type": "error", "message": str(e)})
+
+    return _event_source(event_stream())
+
+
+def _system_message(static_prompt: str, dynamic_suffix: str, model: str) -> Dict[str, Any]:
+    """
+    System message for a prompt; the context-free variant is built once per prompt/provider
+
+    Args:
+        static_prompt: Prompt text that is identical across requests
+        dynamic_suffix: Per-request context appended after it ("" for none)
+        model: Target model name
+
+    Returns:
+        A {"role": "system", ...} message (shared, must not be mutated when static)
+    """
+    if dynamic_suffix:
+        return {"role": "system", "content": _system_content(static_prompt, dynamic_suffix, model)}
+    return _static_system_message(static_prompt, _is_anthropic(model))
+
+
+@functools.lru_cache(maxsize=16)
+def _static_system_message(static_prompt: str, anthropic: bool) -> Dict[str, Any]:
+    """Cached system message for a prompt with no per-request context"""
+    model = "anthropic/" if anthropic else ""
+    return {"role": "system", "content": _system_content(static_prompt, "", model)}
+
+
+def _is_anthropic(model: str) -> bool:
+    """Whether the model takes Anthropic cache_control content blocks"""
+    model = model.lower()
+    return "claude" in model or model.startswith("anthropic/")
+
+
+def _system_content(static_prompt: str, dynamic_suffix: str, model: str) -> Any:
+    """
+    System message content with the constant prompt as a cacheable prefix
+
+    Anthropic models get content blocks with cache_control on the static
+    prompt so its tokens are served from the provider's prompt cache. Other
+    providers (OpenAI, Gemini) cache identical prefixes implicitly, so they
+    get the plain concatenated string with the static prompt first.
+
+    Args:
+        static_prompt: Prompt text that is identical across requests
+        dynamic_suffix: Per-request context appended after it ("" for none)
+        model: Target model name
+
+    Returns:
+        A string, or a list of content blocks for Anthropic models
+    """
+    if _is_anthropic(model):
+        blocks: List[Dict[str, Any]] = [{
+            "type": "text",
+            "text": static_prompt,
+            "cache_control": {"type": "ephemeral"},
+        }]
+        if dynamic_suffix:
+            blocks.append({"type": "text", "text": dynamic_suffix})
+        return blocks
+    if dynamic_suffix:
+        return f"{static_prompt}\n\n{dynamic_suffix}"
+    return static_prompt
+
+
+async def _build_context_block(
+    last_message: str,
+    query_type: QueryType,
+    router_api_key: str,
+    memory_task: Optional[asyncio.Task],
+) -> str:
+    """
+    Gather memory, web search and profile context for the full pipeline.
+
+    Args:
+        last_message: The user's new message
+        query_type: Router classification (FACTUAL triggers a web search)
+        router_api_key: API key for the query-rewrite call
+        memory_task: Memory search already started speculatively, if any
+
+    Returns:
+        Context block to inject into the system prompt
+    """
+    # Search memory (run in thread to avoid blocking), unless already started
+    if memory_task is None:
+        memory_task = asyncio.create_task(
+            _to_thread_fast(memory.search_memory, last_message, n_results=3)
+        )
+
+    # Search web if factual
+    search_results = ""
+    if query_type is QueryType.FACTUAL:
+        # Rewrite query to optimal English search term
+        search_query = last_message
+        try:
+            logger.info(f"Rewriting query for search: {last_message[:50]}...")
+            rewrite_response = await litellm.acompletion(
+                model="gemini/gemini-2.0-flash",
+                messages=[
+                    _SEARCH_REWRITE_SYSTEM_MESSAGE,
+                    {
+                        "role": "user",
+                        "content": last_message
+                    }
+                ],
+                api_key=router_api_key,
+                custom_llm_provider="gemini",
+                max_tokens=50,
+                temperature=0.3,
+            )
+
+            rewritten = rewrite_response.choices[0].message.content
+            if rewritten and rewritten.strip():
+                search_query = rewritten.strip()
+                logger.info(f"Rewritten search query: {search_query}")
+            else:
+                logger.warning("Query rewrite returned empty, using original")
+        except Exception as rewrite_err:
+            logger.warning(f"Query rewrite failed: {rewrite_err}, using original query")
+
+        # Execute search in thread to avoid blocking
+        search_task = asyncio.create_task(
+            asyncio.to_thread(tools.search_web, search_query)
+        )
+        try:
+            search_results = await search_task
+            logger.info("Web search completed")
+        except Exception as e:
+            logger.error(f"Web search failed during execution: {e}")
+            search_results = f"[Error obtaining search results: {e}]"
+
+    # Wait for memory results
+    relevant_memories = await memory_task
+    memory_context = (
+        "\n".join(relevant_memories)
+        if relevant_memories
+        else "No relevant context found"
     )
 
+    # SMART CONTEXT: Get relevant profile memories (max 300 tokens)
+    relevant_profile = await asyncio.to_thread(
+        profile.get_relevant_memories, last_message, max_results=5, max_tokens=300
+    )
+
+    profile_context = ""
+    if relevant_profile:
+        profile_context = "\n".join([
+            f"- {m['key']}: {m['value']}" 
+            for m in relevant_profile
+        ])
+        logger.info(f"Injecting {len(relevant_profile)} profile memories")
+
+    # Build context block
+    context_block = render_context_block(
+        memory_context=memory_context,
+        search_results=search_results,
+    )
+
+    # Add profile context if available
+    if profile_context:
+        context_block += f"\n\nUSER INFO (verified facts about the user):\n{profile_context}"
+
+    return context_block
+
+
+async def _store_turn_memory(
+    user_message: str, answer: str, api_key: Optional[str], metadata: Dict[str, Any]
+) -> None:
+    """Post-response work for a chat turn: vector memory write + auto-extraction"""
+    try:
+        memory_text = f"User: {user_message}\n\nAssistant: {answer}"
+        memory_id = await asyncio.to_thread(memory.add_memory, memory_text, metadata=metadata)
+        logger.info(f"Stored in memory: {memory_id[:8]}...")
+    except Exception as e:
+        logger.error(f"Failed to store turn in memory: {e}", exc_info=True)
+
+    if api_key:
+        logger.info("Triggering auto-extraction...")
+        schedule_extract_memory(user_message, answer, api_key)
+
+
+async def _simple_stream(
+    conversation_id: str,
+    title_task: Optional[asyncio.Task],
+    messages: List[Dict[str, str]],
+    model: str,
+    api_key: str,
+    last_message: str,
+) -> AsyncIterator[bytes]:
+    """
+    SSE stream for the simple path (greetings/small talk).
+
+    Specialized version of chat()'s event_stream: plain streaming, no thinking
+    parsing and no vector-memory write. The turn is still saved to the DB and
+    auto-extraction still runs in the background.
+    """
+    titles = _TitleWatcher(conversation_id, title_task)
+    answer_parts: List[str] = []
+
+    try:
+        yield _sse({"type": "conversation", "conversation_id": conversation_id})
+        yield _SSE_CLASSIFICATION_SIMPLE
+
+        logger.info(f"Generating response with model: {model}")
+        async for frame, chunk_content in generate_stream_frames(
+            messages, model, api_key, _SSE_ANSWER_CHUNK_PREFIX, _SSE_CHUNK_SUFFIX
+        ):
+            answer_parts.append(chunk_content)
+            yield frame
+            title_frame = titles.poll()
+            if title_frame:
+                yield title_frame
+
+        answer = "".join(answer_parts).strip()
+        validation = await validate_response(answer, QueryType.SIMPLE)  # Local check only
+        yield _sse({"type": "validation", "result": validation})
+
+        try:
+            db.add_messages(conversation_id, [
+                ("user", last_message, None),
+                ("assistant", answer, None),
+            ])
+            logger.info(f"Saved messages to conversation {conversation_id}")
+        except Exception as db_error:
+            logger.error(f"Failed to save messages to database: {db_error}", exc_info=True)
+
+        if api_key:
+            logger.info("Triggering auto-extraction...")
+            schedule_extract_memory(last_message, answer, api_key)
+
+        title_frame = titles.poll()
+        if title_frame:
+            yield title_frame
+        yield _SSE_DONE
+
+    except Exception as e:
+        logger.error(f"Chat error: {e}", exc_info=True)
+        yield _sse({"type": "error", "message": str(e)})
+
 
 @app.get("/conversations", response_model=ConversationListResponse)
 async def get_conversations(limit: int = 50) -> ConversationListResponse:
     """Get list of conversations (most recent first)"""
     try:
         conversations = db.get_conversations(limit=limit)
-        return ConversationListResponse(
+        return ConversationListResponse.model_construct(
             conversations=[
-                ConversationResponse(**conv) for conv in conversations
+                ConversationResponse.model_construct(**conv) for conv in conversations
             ]
         )
     except Exception as e:
@@ -553,18 +795,19 @@ async def get_conversations(limit: int = 50) -> ConversationListResponse:
 
 
 @app.get("/conversations/{conversation_id}", response_model=MessageListResponse)
-async def get_conversation(conversation_id: str) -> MessageListResponse:
+async def get_conversation(conversation_id: str) -> ORJSONResponse:
     """Get conversation metadata and all messages"""
     try:
-        conversation = db.get_conversation(conversation_id)
+        conversation, messages = db.get_conversation_with_messages(conversation_id)
         if not conversation:
             raise HTTPException(status_code=404, detail=f"Conversation {conversation_id} not found")
         
-        messages = db.get_messages(conversation_id)
-        return MessageListResponse(
-            conversation_id=conversation_id,
-            messages=[MessageResponse(**msg) for msg in messages]
-        )
+        # Rows come straight from our own schema (MessageListResponse shape) -
+        # serialize them directly instead of validating/dumping per message
+        return ORJSONResponse({
+            "conversation_id": conversation_id,
+            "messages": [dict(zip(MESSAGE_COLUMNS, row)) for row in messages],
+        })
     except HTTPException:
         raise
     except Exception as e:
@@ -585,6 +828,17 @@ async def delete_conversation(conversation_id: str) -> Dict[str, str]:
         raise HTTPException(status_code=500, detail="Failed to delete conversation")
 
 
+@app.post("/conversations/delete")
+async def delete_conversations(request: ConversationDeleteRequest) -> Dict[str, Any]:
+    """Delete several conversations (and their messages) at once"""
+    try:
+        deleted = db.delete_conversations(request.ids)
+        return {"status": "ok", "deleted": deleted}
+    except Exception as e:
+        logger.error(f"Failed to delete conversations: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Failed to delete conversations")
+
+
 @app.patch("/conversations/{conversation_id}/title", response_model=ConversationResponse)
 async def update_conversation_title(
     conversation_id: str,
@@ -596,7 +850,10 @@ async def update_conversation_title(
         conversation = db.get_conversation(conversation_id)
         if not conversation:
             raise HTTPException(status_code=404, detail=f"Conversation {conversation_id} not found")
-        return ConversationResponse(**conversation)
+        conv_id, title, created_at, updated_at = conversation
+        return ConversationResponse.model_construct(
+            id=conv_id, title=title, created_at=created_at, updated_at=updated_at
+        )
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
@@ -627,7 +884,8 @@ async def get_memories(category: str = None, min_importance: int = None):
 async def add_memory(request: MemoryCreateRequest):
     """Manually add a memory"""
     try:
-        entry_id = profile.add_entry(
+        entry_id = await asyncio.to_thread(
+            profile.add_entry,
             category=request.category,
             key=request.key,
             value=request.value,
@@ -643,7 +901,7 @@ async def add_memory(request: MemoryCreateRequest):
 @app.delete("/memory/{entry_id}")
 async def delete_memory(entry_id: str):
     """Delete a memory"""
-    success = profile.delete_entry(entry_id)
+    success = await asyncio.to_thread(profile.delete_entry, entry_id)
     if success:
         return {"status": "deleted"}
     raise HTTPException(status_code=404, detail="Memory not found")
@@ -652,7 +910,7 @@ async def delete_memory(entry_id: str):
 @app.put("/memory/{entry_id}")
 async def update_memory(entry_id: str, request: MemoryUpdateRequest):
     """Update a memory"""
-    success = profile.update_entry(entry_id, request.new_value)
+    success = await asyncio.to_thread(profile.update_entry, entry_id, request.new_value)
     if success:
         return {"status": "updated"}
     raise HTTPException(status_code=404, detail="Memory not found")
@@ -661,7 +919,7 @@ async def update_memory(entry_id: str, request: MemoryUpdateRequest):
 @app.post("/memory/clear")
 async def clear_all_memories():
     """DANGER: Clear all memories"""
-    profile.clear_all()
+    await asyncio.to_thread(profile.clear_all)
     return {"status": "cleared", "warning": "All memories deleted"}
 
 
@@ -677,7 +935,11 @@ async def check_conflicts():
 @app.post("/config/api-key")
 async def set_api_key(request: ApiKeyRequest) -> Dict[str, str]:
     """Store API key for a specific model"""
+    # Store under both spellings so get_api_key is a single dict hit
+    bare_model = request.model.removeprefix("gemini/")
     api_keys[request.model] = request.key
+    api_keys[bare_model] = request.key
+    api_keys[f"gemini/{bare_model}"] = request.key
     logger.info(f"API key configured for model: {request.model}")
     return {"status": "ok", "model": request.model}
 
@@ -1,13 +1,31 @@
+from functools import lru_cache
+from pydantic import Field
 from pydantic_settings import BaseSettings
 from pathlib import Path
+import logging
 import os
 
 
+logger = logging.getLogger(__name__)
+
+
+def _ensure_dir(path: Path) -> None:
+    """Create a directory tree, treating an existing one as success (no stat probe first)"""
+    try:
+        os.makedirs(path)
+    except FileExistsError:
+        pass
+
+
+def _default_app_data_dir() -> Path:
+    return Path(os.getenv("APPDATA", ".")) / "SigmaAgent"
+
+
 class Settings(BaseSettings):
-    # Application directories
-    app_data_dir: Path = Path(os.getenv("APPDATA", ".")) / "SigmaAgent"
-    memory_dir: Path = app_data_dir / "memory"
-    db_path: Path = app_data_dir / "conversations.db"
+    # Application directories (resolved when Settings is built, not at import)
+    app_data_dir: Path = Field(default_factory=_default_app_data_dir)
+    memory_dir: Path = Field(default_factory=lambda: _default_app_data_dir() / "memory")
+    db_path: Path = Field(default_factory=lambda: _default_app_data_dir() / "conversations.db")
 
     # Server settings
     host: str = "127.0.0.1"
@@ -19,6 +37,19 @@ class Settings(BaseSettings):
 
     # Embedding settings
     embedding_model: str = "all-MiniLM-L6-v2"  # Local, no API cost
+    embedding_dim: int = 384  # Must match embedding_model
+    embedding_backend: str = "torch"  # "onnx" runs on ONNX Runtime (needs sentence-transformers[onnx])
+    embedding_onnx_file: str | None = "onnx/model_qint8_avx512_vnni.onnx"  # Int8 export in the model repo
+
+    # Router classification cache
+    classify_cache_size: int = 256
+    classify_cache_threshold: float = 0.95  # Cosine similarity for a hit
+    classify_cache_persist_size: int = 5000  # Rows kept in sqlite-vec, if installed
+    router_anchor_threshold: float = 0.8  # Cosine to a ROUTER_ANCHORS query to skip the LLM
+
+    # Prompt context (memory, web search, profile) for factual/complex queries
+    inject_context_block: bool = True
+    prompt_examples: bool = False  # Append worked examples to the reasoning prompts
 
     # Tools
     tavily_api_key: str | None = None
@@ -28,11 +59,51 @@ class Settings(BaseSettings):
         case_sensitive = False
 
 
-settings = Settings()
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """
+    Process-wide settings, built (and .env parsed) on first use only.
+
+    Also creates the application directories the first time. Each path can
+    be overridden independently, so app_data_dir, memory_dir and db_path's
+    parent are all ensured; a directory shared by several (the defaults
+    nest under app_data_dir) is created only once.
+    """
+    settings = Settings()
+    for directory in dict.fromkeys((settings.app_data_dir, settings.memory_dir, settings.db_path.parent)):
+        _ensure_dir(directory)
+    return settings
+
+
+@lru_cache(maxsize=1)
+def get_embedder():
+    """
+    Process-wide SentenceTransformer for settings.embedding_model
+
+    Loaded on first call and shared by every service that embeds text.
+    With embedding_backend="onnx" the model runs on ONNX Runtime (using the
+    quantized embedding_onnx_file when set); if that can't be loaded the
+    PyTorch backend is used instead.
+    """
+    from sentence_transformers import SentenceTransformer  # Heavy; only when needed
+    settings = get_settings()
+    
+    if settings.embedding_backend == "onnx":
+        model_kwargs = {"file_name": settings.embedding_onnx_file} if settings.embedding_onnx_file else None
+        try:
+            return SentenceTransformer(settings.embedding_model, backend="onnx", model_kwargs=model_kwargs)
+        except Exception as e:
+            logger.warning(f"ONNX embedder unavailable, falling back to PyTorch: {e}")
+    
+    return SentenceTransformer(settings.embedding_model)
+
+
+def __getattr__(name: str):
+    """Resolve the module-level ``settings`` alias lazily (PEP 562)"""
+    if name == "settings":
+        return get_settings()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-# Create directories on import
-settings.memory_dir.mkdir(parents=True, exist_ok=True)
-settings.app_data_dir.mkdir(parents=True, exist_ok=True)
 
 # Model tiers for hybrid mode system
 MODEL_TIERS = {
@@ -1,6 +1,47 @@
-from typing import Literal
+from enum import IntEnum
+from functools import lru_cache
+from string import Formatter
+from typing import Callable, Dict, Tuple
 
-QueryType = Literal["simple", "factual", "complex"]
+from app.core.config import get_settings
+
+
+class QueryType(IntEnum):
+    """Router classification; integer-valued so dispatch tables can index by it"""
+    SIMPLE = 0
+    FACTUAL = 1
+    COMPLEX = 2
+
+    @property
+    def label(self) -> str:
+        """Name used on the wire and in storage ("simple", "factual" or "complex")"""
+        return _QUERY_TYPE_LABELS[self]
+
+
+_QUERY_TYPE_LABELS = ("simple", "factual", "complex")
+
+# Label -> QueryType, for parsing router output and stored labels
+QUERY_TYPES: Dict[str, QueryType] = {label: QueryType(i) for i, label in enumerate(_QUERY_TYPE_LABELS)}
+
+
+def compile_template(template: str) -> Callable[..., str]:
+    """
+    Compile a str.format-style template into a keyword-only render function.
+
+    The template is parsed once and turned into an f-string lambda, so rendering
+    skips str.format's per-call parsing. Only plain {field} placeholders are supported.
+    """
+    body = []
+    fields = []
+    for literal, field, format_spec, conversion in Formatter().parse(template):
+        body.append(literal.replace("{", "{{").replace("}", "}}"))
+        if field is not None:
+            if not field.isidentifier() or format_spec or conversion:
+                raise ValueError(f"Unsupported placeholder in template: {{{field}}}")
+            body.append(f"{{{field}}}")
+            fields.append(field)
+    params = f" *, {', '.join(dict.fromkeys(fields))}" if fields else ""
+    return eval(f"lambda{params}: f{''.join(body)!r}", {})
 
 # Router prompt: Classify user query
 ROUTER_PROMPT = """Analyze the following user query and classify it into ONE category:
@@ -19,56 +60,88 @@ User Query: {query}
 
 Respond with ONLY ONE WORD: simple OR factual OR complex"""
 
-# Chain of Thought prompt for complex queries
-THINKING_PROMPT = """You are a highly intelligent AI assistant capable of deep reasoning.
+# Reference queries per class for the embedding fast path of the router
+# (a query close enough to one of these skips the router LLM)
+ROUTER_ANCHORS: Dict[QueryType, Tuple[str, ...]] = {
+    QueryType.SIMPLE: (
+        "Hello", "Hi, how are you?", "Good morning", "Good evening", "Thanks a lot",
+        "Thank you, that helped", "OK got it", "Goodbye, see you later",
+        "Nice to meet you", "How's it going?", "Cool, thanks", "What's up?",
+        "Hey there, how are you doing?", "Have a nice day", "Good night",
+        "That's great, thank you", "Awesome, appreciate it", "Sounds good",
+        "Perfect, thanks for the help", "See you tomorrow", "Who are you?",
+        "What's your name?", "Tell me a joke", "I'm doing well, thanks",
+        "Yes please", "No thanks", "Great job", "Haha that's funny",
+        "Good afternoon", "Talk to you later",
+    ),
+    QueryType.FACTUAL: (
+        "What's the weather today?", "What is the dollar exchange rate?",
+        "Latest news about the election", "Who won the game last night?",
+        "What is the current price of Bitcoin?", "When does the store open today?",
+        "What time is it in Tokyo right now?", "Stock price of Apple today",
+        "What are today's headlines?", "Is it going to rain tomorrow?",
+        "What is the capital of Australia?", "Who is the current CEO of Tesla?",
+        "When was the Eiffel Tower built?", "How tall is Mount Everest?",
+        "What is the population of Canada?", "Who wrote Pride and Prejudice?",
+        "What's the score of the Lakers game?", "When is the next iPhone release?",
+        "Current inflation rate in the US", "What is the euro to lira rate today?",
+        "Who won the Nobel Prize in Physics this year?", "What movies are playing this weekend?",
+        "How many people live in Istanbul?", "What is the boiling point of water?",
+        "Is the airport open right now?", "What's the temperature in London?",
+        "Latest version of Python", "When is the next solar eclipse?",
+        "Who is the president of France?", "What are the opening hours of the museum?",
+    ),
+    QueryType.COMPLEX: (
+        "Explain quantum entanglement", "Write a Python function to sort a list",
+        "Solve this equation for x", "Compare the pros and cons of microservices",
+        "Debug this code for me", "Prove that the square root of 2 is irrational",
+        "Design a database schema for an online store",
+        "How does a transformer neural network work?",
+        "Refactor this class to be more testable", "Derive the formula for compound interest",
+        "Explain how weather forecast models work", "Write a script that fetches today's date",
+        "Why does my code throw a TypeError?", "Build a stock price prediction model with LSTM",
+        "Summarize the main ideas of stoicism", "Analyze the causes of the French Revolution",
+        "Write an essay on climate change policy", "Implement a binary search tree in Java",
+        "What is the time complexity of quicksort and why?", "Optimize this SQL query",
+        "Help me plan a marketing strategy for my startup", "Translate this paragraph and explain the grammar",
+        "Calculate the integral of x squared times sine x", "Explain the difference between TCP and UDP",
+        "Write a cover letter for a software engineering job", "How do I set up a CI pipeline with Docker?",
+        "Review my React component for performance issues", "Explain recursion with an example",
+        "What are the trade-offs between SQL and NoSQL databases?", "Create a workout plan for beginners",
+    ),
+}
+
+# Chain of Thought prompt for complex queries (kept short: it is prefilled on
+# every complex request)
+THINKING_PROMPT = """You are a highly capable assistant. Structure every response as:
+
+<thinking>Reason step by step: analyze the request, break it down, check your logic, plan the answer.</thinking>
+<answer>The complete, detailed response the user sees: explanations, code, final results.</answer>
+
+Always use both tags."""
 
-IMPORTANT: You MUST structure your response using XML tags:
+# Factual query prompt (requires strict XML tags)
+FACTUAL_PROMPT = """You are a precise assistant for factual questions. Structure every response as:
+
+<thinking>Briefly check the question against any provided context or search results.</thinking>
+<answer>The direct, accurate, concise answer. If the facts are unknown, say so.</answer>
 
-1. <thinking>...</thinking> tags: This is your BRAIN. Use it to think deeply before answering.
-   - Analyze the user's request in detail.
-   - Break down complex problems into steps.
-   - Consider multiple perspectives or approaches.
-   - Self-correct if you detect potential errors in your logic.
-   - Draft your response structure.
-   - DO NOT be brief here. Take as much space as you need to ensure high-quality reasoning.
+Always use both tags."""
 
-2. <answer>...</answer> tags: This is where your ACTUAL detailed response goes.
-   - Put ALL explanations, detailed content, code examples, and final answers here.
-   - This is what the user will see as your response.
-   - Be thorough and complete in the <answer> section.
+# Worked examples for the prompts above; only appended (by reasoning_prompt)
+# when settings.prompt_examples is on (few-shot debugging)
+THINKING_PROMPT_EXAMPLE = """
 
-Example format:
+Example:
 <thinking>
-The user is asking about [Topic].
-Key concepts to cover: A, B, C.
-Potential pitfalls: [X].
-Structure of the answer:
-1. Introduction
-2. Detailed analysis of A
-3. Comparison of B and C
-4. Conclusion
-Let me verify fact [Y]... Yes, it is correct.
+The user is asking about [Topic]. Key concepts: A, B, C. Pitfall: [X].
+Plan: introduction, analysis of A, comparison of B and C, conclusion.
 </thinking>
 <answer>
 [Your comprehensive, well-structured response]
-</answer>
+</answer>"""
 
-Always use these tags. The quality of your <answer> depends on the depth of your <thinking>."""
-
-# Factual query prompt (requires strict XML tags)
-FACTUAL_PROMPT = """You are a precise and helpful AI assistant specialized in factual information.
-
-IMPORTANT: You MUST structure your response using XML tags. This is critical for the system to parse your answer.
-
-1. <thinking>...</thinking>:
-   - Briefly analyze the user's question.
-   - Check any provided context or search results.
-   - Verify the facts before stating them.
-
-2. <answer>...</answer>:
-   - Provide the direct, accurate answer.
-   - Be concise and objective.
-   - Do not hallucinate; if the information is not known, state that.
+FACTUAL_PROMPT_EXAMPLE = """
 
 Example:
 <thinking>
@@ -76,9 +149,29 @@ The user asked for the boiling point of water. This is a standard fact.
 </thinking>
 <answer>
 The boiling point of water is 100 degrees Celsius (212 degrees Fahrenheit) at standard atmospheric pressure.
-</answer>
+</answer>"""
+
 
-Always use <thinking> and <answer> tags."""
+
+@lru_cache(maxsize=4)
+def reasoning_prompt(query_type: QueryType) -> str:
+    """
+    Tag-structured prompt for a factual or complex query
+
+    Settings are read on first call (not at import); the worked example is
+    appended when settings.prompt_examples is on.
+
+    Args:
+        query_type: FACTUAL gets FACTUAL_PROMPT, anything else THINKING_PROMPT
+
+    Returns:
+        The prompt text (the same object on every call for a query type)
+    """
+    if query_type is QueryType.FACTUAL:
+        prompt, example = FACTUAL_PROMPT, FACTUAL_PROMPT_EXAMPLE
+    else:
+        prompt, example = THINKING_PROMPT, THINKING_PROMPT_EXAMPLE
+    return prompt + example if get_settings().prompt_examples else prompt
 
 # Simple query prompt (no thinking needed)
 SIMPLE_PROMPT = """You are a friendly, helpful AI assistant. 
@@ -95,3 +188,8 @@ Memory Context (from past conversations):
 Search Results (if applicable):
 {search_results}
 """
+
+# Precompiled renderers for the per-request templates
+render_router_prompt = compile_template(ROUTER_PROMPT)
+render_simple_prompt = compile_template(SIMPLE_PROMPT)
+render_context_block = compile_template(CONTEXT_TEMPLATE)
@@ -1,17 +1,37 @@
+import importlib.util
 import logging
 
-import uvicorn
-
-from app.core.config import settings
+from app.core.config import get_settings
 
 
 logger = logging.getLogger(__name__)
 
 
+def _server_backends() -> tuple[str, str]:
+    """Pick uvloop/httptools when installed (not available on Windows), else stdlib fallbacks"""
+    loop = "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+    http = "httptools" if importlib.util.find_spec("httptools") else "h11"
+    return loop, http
+
+
 if __name__ == "__main__":
+    # Entry-point only: keeps "import app.main" free of uvicorn's import cost
+    import uvicorn
+
+    # Configure logging before the startup messages below (app.api's own
+    # basicConfig becomes a no-op once this has run)
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    )
+
+    settings = get_settings()
+    loop, http = _server_backends()
+
     logger.info("Starting Sigma Agent Backend")
     logger.info(f"Server: http://{settings.host}:{settings.port}")
     logger.info(f"Memory: {settings.memory_dir}")
+    logger.info(f"Event loop: {loop}, HTTP parser: {http}")
 
     uvicorn.run(
         "app.api:app",
@@ -19,4 +39,6 @@ if __name__ == "__main__":
         port=settings.port,
         reload=False,  # Set to False in production
         log_level="info",
+        loop=loop,
+        http=http,
     )
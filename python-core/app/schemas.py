@@ -56,6 +56,10 @@ class TitleUpdateRequest(BaseModel):
     title: str
 
 
+class ConversationDeleteRequest(BaseModel):
+    ids: List[str]  # Conversation IDs; unknown IDs are ignored
+
+
 class MemoryCreateRequest(BaseModel):
     category: str  # personal, family, tech, work, preferences
     key: str  # Brief identifier
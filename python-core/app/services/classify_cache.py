@@ -0,0 +1,296 @@
+import asyncio
+import logging
+import re
+from collections import OrderedDict
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from app.core.config import get_settings
+from app.core.prompts import QUERY_TYPES, ROUTER_ANCHORS, QueryType
+from app.services.database import DatabaseService
+from app.services.memory import memory
+from app.services.router import request_classification
+
+
+logger = logging.getLogger(__name__)
+
+EXACT_CACHE_SIZE = 4096  # Normalized query strings remembered verbatim
+
+_PUNCTUATION_RE = re.compile(r"[^\w\s]+")
+# Matched against the whole normalized query, so "ok, explain X" still goes to the router
+_GREETING_RE = re.compile(
+    r"(?:hi|hello|hey|thanks|thank you|ok|okay|bye|goodbye)(?: there| again| so much)?"
+)
+try:
+    from numba import njit
+except ImportError:  # Optional: fall back to a numpy matmul
+    njit = None
+
+
+def _best_match_numpy(bank: np.ndarray, query: np.ndarray) -> Tuple[int, float]:
+    """Index and dot product of the bank row closest to query"""
+    similarities = bank @ query
+    idx = int(np.argmax(similarities))
+    return idx, float(similarities[idx])
+
+
+if njit is not None:
+    @njit(fastmath=True, cache=True)
+    def _best_match(bank: np.ndarray, query: np.ndarray) -> Tuple[int, float]:
+        """Fused dot-product + argmax scan over unit-length rows"""
+        best_idx = 0
+        best = -2.0
+        for i in range(bank.shape[0]):
+            acc = 0.0
+            for j in range(bank.shape[1]):
+                acc += bank[i, j] * query[j]
+            if acc > best:
+                best = acc
+                best_idx = i
+        return best_idx, best
+else:
+    _best_match = _best_match_numpy
+
+
+def normalize_query(query: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace"""
+    return " ".join(_PUNCTUATION_RE.sub(" ", query.lower()).split())
+
+
+def _hint_label(key: str) -> Optional[QueryType]:
+    """
+    Classify from surface features alone, or None if they are inconclusive
+
+    Only a query that is nothing but a greeting/acknowledgement is decided
+    here; keyword hits inside longer queries ("weather", "today", "2 + 2")
+    are too ambiguous to skip the router on.
+    """
+    if _GREETING_RE.fullmatch(key):
+        return QueryType.SIMPLE
+    return None
+
+
+class AnchorRouter:
+    """
+    Nearest-anchor classifier over the ROUTER_ANCHORS reference queries
+
+    The anchor embeddings are computed once, on first use, with the shared
+    memory embedder.
+    """
+
+    def __init__(self, threshold: float):
+        self.threshold = threshold
+        self._bank: Optional[np.ndarray] = None  # (n_anchors, dim), unit rows
+        self._labels: List[QueryType] = []
+
+    @property
+    def ready(self) -> bool:
+        return self._bank is not None
+
+    def build(self) -> None:
+        """Embed the anchor queries (blocking; run in a worker thread)"""
+        texts = [text for anchors in ROUTER_ANCHORS.values() for text in anchors]
+        labels = [label for label, anchors in ROUTER_ANCHORS.items() for _ in anchors]
+        bank = np.asarray(memory.embedder.encode(texts), dtype=np.float32)
+        bank /= np.linalg.norm(bank, axis=1, keepdims=True)
+        self._labels = labels
+        self._bank = bank
+
+    def classify(self, embedding: np.ndarray) -> Optional[QueryType]:
+        """Label of the closest anchor if its cosine clears the threshold"""
+        idx, similarity = _best_match_numpy(self._bank, embedding)
+        return self._labels[idx] if similarity > self.threshold else None
+
+
+class ClassifyCache:
+    """
+    Semantic LRU cache of router classifications
+
+    Exact repeats (after normalize_query) are answered from a plain dict LRU
+    before any embedding is computed.
+    Stores L2-normalized query embeddings in a preallocated float32 matrix so a
+    lookup is a single dot-product + argmax scan (numba-compiled if installed). Least recently used rows are evicted.
+    Optionally backed by a persistent store (sqlite-vec) that survives restarts.
+    """
+
+    def __init__(self, max_entries: int, threshold: float):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.store: Optional[DatabaseService] = None  # Attached at startup if available
+        self._matrix: Optional[np.ndarray] = None  # (max_entries, dim)
+        self._last_used = np.zeros(max_entries, dtype=np.int64)
+        self._labels: List[QueryType] = []
+        self._size = 0
+        self._tick = 0
+        self._exact: "OrderedDict[str, QueryType]" = OrderedDict()
+
+    def attach_store(self, store: DatabaseService) -> None:
+        """Use the database's vector table as a persistent second-level cache"""
+        self.store = store if store.vector_cache_enabled else None
+
+    @staticmethod
+    def normalize(embedding: np.ndarray) -> np.ndarray:
+        """Flatten to float32 and scale to unit length"""
+        vector = np.asarray(embedding, dtype=np.float32).ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def lookup_exact(self, key: str) -> Optional[QueryType]:
+        """Return the label of a previously seen normalized query"""
+        label = self._exact.get(key)
+        if label is not None:
+            self._exact.move_to_end(key)
+        return label
+
+    def add_exact(self, key: str, label: QueryType) -> None:
+        """Remember a normalized query's label, evicting the oldest if full"""
+        if not key:
+            return
+        self._exact[key] = label
+        self._exact.move_to_end(key)
+        if len(self._exact) > EXACT_CACHE_SIZE:
+            self._exact.popitem(last=False)
+
+    def lookup(self, embedding: np.ndarray) -> Optional[QueryType]:
+        """Return the cached label of the most similar query, if above threshold"""
+        if self._size == 0:
+            return None
+
+        vector = self.normalize(embedding)
+        idx, similarity = _best_match(self._matrix[:self._size], vector)
+        if similarity < self.threshold:
+            return None
+
+        self._tick += 1
+        self._last_used[idx] = self._tick
+        return self._labels[idx]
+
+    def add(self, embedding: np.ndarray, label: QueryType) -> None:
+        """Insert a classification, evicting the least recently used entry if full"""
+        vector = self.normalize(embedding)
+        if self._matrix is None:
+            self._matrix = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+
+        if self._size < self.max_entries:
+            idx = self._size
+            self._size += 1
+            self._labels.append(label)
+        else:
+            idx = int(np.argmin(self._last_used))
+            self._labels[idx] = label
+
+        self._matrix[idx] = vector
+        self._tick += 1
+        self._last_used[idx] = self._tick
+
+
+async def lookup_cached_classification(
+    query: str,
+) -> Tuple[Optional[QueryType], Optional[np.ndarray]]:
+    """
+    Classify a query without the router LLM, if possible
+
+    Checks, in order: exact normalized repeats, whole-query greetings, the
+    in-memory semantic cache, the persistent store, then the nearest
+    ROUTER_ANCHORS query.
+
+    Args:
+        query: User's input text
+
+    Returns:
+        (cached label or None, normalized query embedding or None if unavailable).
+        Pass the embedding on to classify_uncached to avoid re-embedding.
+    """
+    classify_cache = get_classify_cache()
+    key = normalize_query(query)
+    cached = classify_cache.lookup_exact(key)
+    if cached is not None:
+        logger.info(f"Query classified as: {cached.label} (exact cache hit)")
+        return cached, None
+
+    hinted = _hint_label(key)
+    if hinted is not None:
+        logger.info(f"Query classified as: {hinted.label} (pattern)")
+        return hinted, None
+
+    if memory.embedder is None:
+        return None, None
+
+    try:
+        embedding = ClassifyCache.normalize(
+            await asyncio.to_thread(memory.embed_query, query)
+        )
+        cached = classify_cache.lookup(embedding)
+        store = classify_cache.store
+        if cached is None and store is not None:
+            stored = await asyncio.to_thread(
+                store.lookup_classification, embedding, classify_cache.threshold
+            )
+            cached = QUERY_TYPES.get(stored) if stored is not None else None
+            if cached is not None:
+                classify_cache.add(embedding, cached)
+        if cached is not None:
+            classify_cache.add_exact(key, cached)
+            logger.info(f"Query classified as: {cached.label} (cache hit)")
+            return cached, embedding
+
+        anchor_router = get_anchor_router()
+        if not anchor_router.ready:
+            await asyncio.to_thread(anchor_router.build)
+        anchored = anchor_router.classify(embedding)
+        if anchored is not None:
+            logger.info(f"Query classified as: {anchored.label} (anchor match)")
+        return anchored, embedding
+    except Exception as e:
+        logger.warning(f"Classification cache lookup failed: {e}")
+        return None, None
+
+
+async def classify_uncached(
+    query: str, api_key: str, embedding: Optional[np.ndarray] = None
+) -> QueryType:
+    """
+    Classify a query with the router LLM and cache the result
+
+    Only successful LLM classifications are cached, never the error default.
+
+    Args:
+        query: User's input text
+        api_key: API key for the router model (Gemini)
+        embedding: Normalized query embedding from lookup_cached_classification
+
+    Returns:
+        QueryType: SIMPLE | FACTUAL | COMPLEX
+    """
+    try:
+        query_type = await request_classification(query, api_key)
+    except Exception as e:
+        logger.error(f"Classification failed: {e}, defaulting to 'complex'")
+        return QueryType.COMPLEX  # Safe default on error
+
+    classify_cache = get_classify_cache()
+    classify_cache.add_exact(normalize_query(query), query_type)
+    if embedding is not None:
+        classify_cache.add(embedding, query_type)
+        store = classify_cache.store
+        if store is not None:
+            await asyncio.to_thread(store.store_classification, embedding, query_type.label)
+    return query_type
+
+
+@lru_cache(maxsize=1)
+def get_classify_cache() -> ClassifyCache:
+    """Process-wide classification cache, built from settings on first use"""
+    settings = get_settings()
+    return ClassifyCache(
+        max_entries=settings.classify_cache_size,
+        threshold=settings.classify_cache_threshold,
+    )
+
+
+@lru_cache(maxsize=1)
+def get_anchor_router() -> AnchorRouter:
+    """Process-wide anchor router, built from settings on first use"""
+    return AnchorRouter(threshold=get_settings().router_anchor_threshold)
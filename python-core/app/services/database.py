@@ -1,14 +1,56 @@
 import sqlite3
 import logging
+import threading
+import time
 import uuid
-from datetime import datetime
-from typing import List, Dict, Optional
+from contextlib import contextmanager
+from typing import Iterator, List, Dict, Optional, Tuple
 from pathlib import Path
 
-from app.core.config import settings
+import numpy as np
+
+from app.core.config import get_settings
 
 logger = logging.getLogger(__name__)
 
+# Column order of the tuples returned by iter_messages / get_conversation_with_messages
+MESSAGE_COLUMNS = ("id", "conversation_id", "role", "content", "thinking", "created_at")
+_MESSAGE_SELECT = ", ".join(MESSAGE_COLUMNS)
+
+_timestamp_cache: Tuple[int, str] = (-1, "")
+
+# Unit-vector components are in [-1, 1]; int8 storage keeps them scaled by this
+_INT8_SCALE = 127.0
+
+
+def _utc_now_iso() -> str:
+    """
+    Current UTC time as an ISO-8601 string (second precision)
+
+    The string is formatted at most once per second and reused in between.
+    """
+    global _timestamp_cache
+    second = int(time.time())
+    cached_second, cached = _timestamp_cache
+    if second != cached_second:
+        cached = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(second))
+        _timestamp_cache = (second, cached)
+    return cached
+
+
+def _quantize_int8(embedding: np.ndarray) -> bytes:
+    """
+    Encode an L2-normalized embedding as int8 bytes for sqlite-vec
+
+    Args:
+        embedding: L2-normalized float embedding
+
+    Returns:
+        Raw int8 blob (one byte per dimension)
+    """
+    scaled = np.asarray(embedding, dtype=np.float32) * _INT8_SCALE
+    return np.clip(np.rint(scaled), -127, 127).astype(np.int8).tobytes()
+
 
 class DatabaseService:
     """
@@ -18,10 +60,12 @@ class DatabaseService:
 
     def __init__(self):
         """Initialize database service with connection path"""
-        self.db_path = settings.db_path
-        # Ensure parent directory exists
-        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        # Parent directory is created by get_settings()
+        self.db_path = get_settings().db_path
         self._initialized = False
+        self.vector_cache_enabled = False  # Set when the sqlite-vec extension loads
+        self._conn: Optional[sqlite3.Connection] = None  # Opened on first use, shared
+        self._lock = threading.RLock()  # Serializes use of the shared connection
 
     def initialize(self) -> None:
         """Create database tables if they don't exist"""
@@ -52,7 +96,9 @@ class DatabaseService:
                     )
                 """)
                 
-                # Create index on conversation_id for faster queries
+                # Create index on conversation_id for faster queries; index entries
+                # carry the rowid, so "WHERE conversation_id = ? ORDER BY rowid"
+                # is served in order straight from this index
                 cursor.execute("""
                     CREATE INDEX IF NOT EXISTS idx_messages_conversation_id 
                     ON messages(conversation_id)
@@ -64,7 +110,6 @@ class DatabaseService:
                     ON conversations(updated_at DESC)
                 """)
                 
-                conn.commit()
                 self._initialized = True
                 logger.info(f"Database initialized at {self.db_path}")
                 
@@ -72,12 +117,94 @@ class DatabaseService:
             logger.error(f"Failed to initialize database: {e}", exc_info=True)
             raise
 
-    def _get_connection(self) -> sqlite3.Connection:
-        """Get a database connection with row factory"""
-        conn = sqlite3.connect(str(self.db_path))
+        self._initialize_vector_cache()
+
+    def _initialize_vector_cache(self) -> None:
+        """Create the persistent classification cache tables if sqlite-vec is available"""
+        try:
+            with self._get_connection() as conn:
+                if not self._load_vec_extension(conn):
+                    return
+                cursor = conn.cursor()
+                
+                # Superseded FP32 table: drop it along with the labels it pointed to
+                cursor.execute("""
+                    SELECT 1 FROM sqlite_master WHERE name = 'vec_classify_cache'
+                """)
+                legacy_cache = cursor.fetchone() is not None
+                
+                # Normalized query embeddings quantized to int8 (4x smaller than FP32);
+                # rowid links to classify_cache_labels.id
+                cursor.execute(f"""
+                    CREATE VIRTUAL TABLE IF NOT EXISTS vec_classify_cache_i8
+                    USING vec0(embedding INT8[{get_settings().embedding_dim}])
+                """)
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS classify_cache_labels (
+                        id INTEGER PRIMARY KEY,
+                        query_type TEXT NOT NULL,
+                        created_at TEXT NOT NULL
+                    )
+                """)
+                if legacy_cache:
+                    cursor.execute("DROP TABLE vec_classify_cache")
+                    cursor.execute("DELETE FROM classify_cache_labels")
+                
+                self.vector_cache_enabled = True
+                logger.info("Persistent classification cache enabled (sqlite-vec)")
+        except Exception as e:
+            logger.warning(f"Persistent classification cache unavailable: {e}")
+            self.vector_cache_enabled = False
+
+    def _load_vec_extension(self, conn: sqlite3.Connection) -> bool:
+        """Load sqlite-vec into a connection; False if it isn't installed/loadable"""
+        try:
+            import sqlite_vec
+            conn.enable_load_extension(True)
+            sqlite_vec.load(conn)
+            conn.enable_load_extension(False)
+            return True
+        except Exception as e:
+            logger.info(f"sqlite-vec not available, using in-memory classification cache only: {e}")
+            return False
+
+    def _open_connection(self) -> sqlite3.Connection:
+        """Open the long-lived connection and apply per-connection pragmas"""
+        conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
         conn.row_factory = sqlite3.Row  # Enable dict-like access
+        # WAL lets readers proceed during writes and makes commits cheaper
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")  # Safe with WAL, no fsync per commit
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA mmap_size=268435456")  # 256 MB
+        # Enforce the messages -> conversations FK (and its ON DELETE CASCADE);
+        # sqlite leaves it off per connection unless asked
+        conn.execute("PRAGMA foreign_keys=ON")
+        if self.vector_cache_enabled:
+            self._load_vec_extension(conn)
         return conn
 
+    @contextmanager
+    def _get_connection(self) -> Iterator[sqlite3.Connection]:
+        """
+        Borrow the shared connection for one transaction
+
+        Holds the lock for the duration of the block; commits on success and
+        rolls back on error.
+        """
+        with self._lock:
+            if self._conn is None:
+                self._conn = self._open_connection()
+            with self._conn:
+                yield self._conn
+
+    def close(self) -> None:
+        """Close the shared connection (reopened on next use)"""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
     def create_conversation(self, title: str) -> str:
         """
         Create a new conversation
@@ -86,10 +213,10 @@ class DatabaseService:
             title: Conversation title
             
         Returns:
-            Conversation UUID string
+            Conversation ID (32-char hex UUID)
         """
-        conversation_id = str(uuid.uuid4())
-        now = datetime.utcnow().isoformat()
+        conversation_id = uuid.uuid4().hex
+        now = _utc_now_iso()
         
         try:
             with self._get_connection() as conn:
@@ -98,7 +225,6 @@ class DatabaseService:
                     INSERT INTO conversations (id, title, created_at, updated_at)
                     VALUES (?, ?, ?, ?)
                 """, (conversation_id, title, now, now))
-                conn.commit()
                 logger.info(f"Created conversation: {conversation_id} - {title}")
                 return conversation_id
         except Exception as e:
@@ -120,12 +246,11 @@ class DatabaseService:
                     UPDATE conversations 
                     SET title = ?, updated_at = ?
                     WHERE id = ?
-                """, (title, datetime.utcnow().isoformat(), conversation_id))
+                """, (title, _utc_now_iso(), conversation_id))
                 
                 if cursor.rowcount == 0:
                     raise ValueError(f"Conversation {conversation_id} not found")
                 
-                conn.commit()
                 logger.info(f"Updated conversation title: {conversation_id} - {title}")
         except Exception as e:
             logger.error(f"Failed to update conversation title: {e}", exc_info=True)
@@ -148,20 +273,42 @@ class DatabaseService:
             thinking: Optional thinking/reasoning content (for assistant messages)
             
         Returns:
-            Message UUID string
+            Message ID (32-char hex UUID)
+        """
+        return self.add_messages(conversation_id, [(role, content, thinking)])[0]
+
+    def add_messages(
+        self,
+        conversation_id: str,
+        messages: List[Tuple[str, str, Optional[str]]]
+    ) -> List[str]:
+        """
+        Add several messages to a conversation in a single transaction
+
+        The inserts (one executemany) and the updated_at bump share one commit.
+        
+        Args:
+            conversation_id: Conversation UUID
+            messages: (role, content, thinking) tuples, in conversation order
+            
+        Returns:
+            Message IDs (32-char hex UUIDs), in the same order
         """
-        message_id = str(uuid.uuid4())
-        now = datetime.utcnow().isoformat()
+        now = _utc_now_iso()
+        rows = [
+            (uuid.uuid4().hex, conversation_id, role, content, thinking, now)
+            for role, content, thinking in messages
+        ]
         
         try:
             with self._get_connection() as conn:
                 cursor = conn.cursor()
                 
-                # Insert message
-                cursor.execute("""
+                # Insert messages
+                cursor.executemany("""
                     INSERT INTO messages (id, conversation_id, role, content, thinking, created_at)
                     VALUES (?, ?, ?, ?, ?, ?)
-                """, (message_id, conversation_id, role, content, thinking, now))
+                """, rows)
                 
                 # Update conversation updated_at timestamp
                 cursor.execute("""
@@ -170,14 +317,13 @@ class DatabaseService:
                     WHERE id = ?
                 """, (now, conversation_id))
                 
-                conn.commit()
-                logger.debug(f"Added message {message_id} to conversation {conversation_id}")
-                return message_id
+                logger.debug(f"Added {len(rows)} messages to conversation {conversation_id}")
+                return [row[0] for row in rows]
         except sqlite3.IntegrityError as e:
             logger.error(f"Foreign key violation: {e}", exc_info=True)
             raise ValueError(f"Conversation {conversation_id} not found")
         except Exception as e:
-            logger.error(f"Failed to add message: {e}", exc_info=True)
+            logger.error(f"Failed to add messages: {e}", exc_info=True)
             raise
 
     def get_conversations(self, limit: int = 50) -> List[Dict]:
@@ -206,7 +352,7 @@ class DatabaseService:
             logger.error(f"Failed to get conversations: {e}", exc_info=True)
             raise
 
-    def get_conversation(self, conversation_id: str) -> Optional[Dict]:
+    def get_conversation(self, conversation_id: str) -> Optional[Tuple]:
         """
         Get a single conversation by ID
         
@@ -214,49 +360,90 @@ class DatabaseService:
             conversation_id: Conversation UUID
             
         Returns:
-            Conversation dict or None if not found
+            (id, title, created_at, updated_at) tuple or None if not found
         """
         try:
             with self._get_connection() as conn:
                 cursor = conn.cursor()
+                cursor.row_factory = None  # Plain tuple, no Row/dict wrapping
                 cursor.execute("""
                     SELECT id, title, created_at, updated_at
                     FROM conversations
                     WHERE id = ?
                 """, (conversation_id,))
                 
-                row = cursor.fetchone()
-                return dict(row) if row else None
+                return cursor.fetchone()
         except Exception as e:
             logger.error(f"Failed to get conversation: {e}", exc_info=True)
             raise
 
-    def get_messages(self, conversation_id: str) -> List[Dict]:
+    def get_conversation_with_messages(
+        self, conversation_id: str
+    ) -> Tuple[Optional[Tuple], List[Tuple]]:
         """
-        Get all messages for a conversation
+        Get a conversation and its messages using a single connection
         
         Args:
             conversation_id: Conversation UUID
             
         Returns:
-            List of message dicts ordered by created_at
+            ((id, title, created_at, updated_at) tuple as from get_conversation,
+            or None if not found; message rows in insertion order).
+            Message rows are plain tuples in MESSAGE_COLUMNS order.
         """
         try:
             with self._get_connection() as conn:
                 cursor = conn.cursor()
+                cursor.row_factory = None  # Plain tuples, no Row/dict wrapping
                 cursor.execute("""
-                    SELECT id, conversation_id, role, content, thinking, created_at
+                    SELECT id, title, created_at, updated_at
+                    FROM conversations
+                    WHERE id = ?
+                """, (conversation_id,))
+                
+                row = cursor.fetchone()
+                if not row:
+                    return None, []
+                
+                cursor.execute(f"""
+                    SELECT {_MESSAGE_SELECT}
                     FROM messages
                     WHERE conversation_id = ?
-                    ORDER BY created_at ASC
+                    ORDER BY rowid ASC
                 """, (conversation_id,))
                 
-                rows = cursor.fetchall()
-                return [dict(row) for row in rows]
+                return row, cursor.fetchall()
         except Exception as e:
-            logger.error(f"Failed to get messages: {e}", exc_info=True)
+            logger.error(f"Failed to get conversation with messages: {e}", exc_info=True)
             raise
 
+    def iter_messages(self, conversation_id: str) -> Iterator[Tuple]:
+        """
+        Stream a conversation's messages as plain tuples
+
+        Rows are fetched in batches rather than all at once and are not wrapped
+        in dicts. The shared connection stays locked until the generator is
+        exhausted or closed, so consume it promptly.
+
+        Args:
+            conversation_id: Conversation UUID
+
+        Yields:
+            Message rows in MESSAGE_COLUMNS order, in insertion order
+        """
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = None
+            cursor.arraysize = 256
+            cursor.execute(f"""
+                SELECT {_MESSAGE_SELECT}
+                FROM messages
+                WHERE conversation_id = ?
+                ORDER BY rowid ASC
+            """, (conversation_id,))
+            while rows := cursor.fetchmany():
+                yield from rows
+
     def delete_conversation(self, conversation_id: str) -> None:
         """
         Delete a conversation and all its messages (cascade delete)
@@ -272,8 +459,101 @@ class DatabaseService:
                 if cursor.rowcount == 0:
                     raise ValueError(f"Conversation {conversation_id} not found")
                 
-                conn.commit()
                 logger.info(f"Deleted conversation: {conversation_id}")
         except Exception as e:
             logger.error(f"Failed to delete conversation: {e}", exc_info=True)
             raise
+
+    def delete_conversations(self, conversation_ids: List[str]) -> int:
+        """
+        Delete several conversations (and their messages) in one transaction
+        
+        Args:
+            conversation_ids: Conversation UUIDs; unknown IDs are ignored
+            
+        Returns:
+            Number of conversations deleted
+        """
+        try:
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.executemany(
+                    "DELETE FROM conversations WHERE id = ?",
+                    [(conversation_id,) for conversation_id in conversation_ids],
+                )
+                deleted = cursor.rowcount
+                logger.info(f"Deleted {deleted} conversations")
+                return deleted
+        except Exception as e:
+            logger.error(f"Failed to delete conversations: {e}", exc_info=True)
+            raise
+
+    def lookup_classification(self, embedding: np.ndarray, threshold: float) -> Optional[str]:
+        """
+        Find the cached classification of the nearest stored query embedding
+        
+        Args:
+            embedding: L2-normalized query embedding
+            threshold: Minimum cosine similarity for a hit
+            
+        Returns:
+            Query type string or None on miss (or when sqlite-vec is unavailable)
+        """
+        if not self.vector_cache_enabled:
+            return None
+        
+        try:
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT l.query_type, v.distance
+                    FROM (
+                        SELECT rowid, distance
+                        FROM vec_classify_cache_i8
+                        WHERE embedding MATCH vec_int8(?) AND k = 1
+                    ) v
+                    JOIN classify_cache_labels l ON l.id = v.rowid
+                """, (_quantize_int8(embedding),))
+                
+                row = cursor.fetchone()
+                if not row:
+                    return None
+                # L2 distance between unit vectors: cos = 1 - d^2 / 2
+                # (int8 distances are in units of 1/_INT8_SCALE)
+                distance = row["distance"] / _INT8_SCALE
+                similarity = 1.0 - (distance ** 2) / 2.0
+                return row["query_type"] if similarity >= threshold else None
+        except Exception as e:
+            logger.warning(f"Persistent classification lookup failed: {e}")
+            return None
+
+    def store_classification(self, embedding: np.ndarray, query_type: str) -> None:
+        """
+        Persist a query classification, trimming the oldest entries past the limit
+        
+        Args:
+            embedding: L2-normalized query embedding
+            query_type: Classification label
+        """
+        if not self.vector_cache_enabled:
+            return
+        
+        try:
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    INSERT INTO classify_cache_labels (query_type, created_at)
+                    VALUES (?, ?)
+                """, (query_type, _utc_now_iso()))
+                rowid = cursor.lastrowid
+                cursor.execute("""
+                    INSERT INTO vec_classify_cache_i8 (rowid, embedding)
+                    VALUES (?, vec_int8(?))
+                """, (rowid, _quantize_int8(embedding)))
+                
+                cutoff = rowid - get_settings().classify_cache_persist_size
+                if cutoff > 0:
+                    cursor.execute("DELETE FROM vec_classify_cache_i8 WHERE rowid <= ?", (cutoff,))
+                    cursor.execute("DELETE FROM classify_cache_labels WHERE id <= ?", (cutoff,))
+        except Exception as e:
+            logger.warning(f"Failed to persist classification: {e}")
@@ -1,10 +1,32 @@
+import asyncio
 import litellm
-import json
 import logging
+import re
+from typing import Dict, List, Optional, Set, Tuple, Type, TypeVar, Union
+
+import msgspec
+from app.core.prompts import compile_template
 from app.services.profile import profile
 
 logger = logging.getLogger(__name__)
 
+EXTRACTION_CONCURRENCY = 32  # Extraction LLM calls allowed in flight at once
+EXTRACTION_BATCH_WINDOW_MS = 30  # How long the batcher waits for more turns
+EXTRACTION_MAX_BATCH = 8  # Turns packed into one extraction call at most
+
+_extract_semaphore = asyncio.Semaphore(EXTRACTION_CONCURRENCY)
+_pending_extractions: Set[asyncio.Task] = set()  # Strong refs until each task finishes
+
+# First-person / ownership cues; a turn without any is treated as nothing to save
+_SIGNAL_RE = re.compile(
+    r"\b(?:i(?:'m| am| use| like| love| prefer| work| live| have| study)|my|mine"
+    r"|we use|our|favou?rite|call me)\b",
+    re.IGNORECASE,
+)
+
+# A fenced ```json block (preferred) or else the outermost bare {...} object
+_JSON_BLOCK_RE = re.compile(r"```(?:json)?\s*(\{.*?\})\s*```|(\{.*\})", re.DOTALL)
+
 EXTRACTION_PROMPT = """You are a memory extraction AI. Your job is to identify if the user revealed PERSONAL INFORMATION that should be saved.
 
 SAVE IF:
@@ -37,78 +59,310 @@ OUTPUT (JSON only, no explanation):
 If nothing to save: {{"memories": []}}
 """
 
+EXTRACTION_BATCH_PROMPT = """You are a memory extraction AI. For EACH conversation below, identify if the user revealed PERSONAL INFORMATION that should be saved.
 
-async def auto_extract_memory(user_message: str, ai_response: str, api_key: str) -> bool:
+SAVE IF: personal details, preferences, technical info (devices, projects, skills), work/education details.
+DO NOT SAVE: small talk, general questions, temporary states.
+
+{conversations}
+
+OUTPUT (JSON only, no explanation) - exactly one entry per conversation, in order:
+{{
+  "results": [
+    {{"memories": [{{"category": "personal/family/tech/work/preferences", "key": "brief_identifier", "value": "the actual information", "importance": 1-10}}]}},
+    {{"memories": []}}
+  ]
+}}
+"""
+
+class ExtractedMemory(msgspec.Struct):
     """
-    Automatically extract and save memory from conversation
-    
-    Returns True if memory was saved
+    One memory item from the extraction model's reply
+
+    Typed loosely (nulls, "high" as importance) so one malformed item is
+    dropped by _new_memory_entries instead of failing the whole decode.
     """
-    try:
-        prompt = EXTRACTION_PROMPT.format(
-            user_message=user_message,
-            ai_response=ai_response
-        )
-        
+    category: Optional[str] = "personal"
+    key: Optional[str] = None
+    value: Optional[str] = None
+    importance: Union[int, str, None] = 5
+
+
+class ExtractionResult(msgspec.Struct):
+    """Reply schema of EXTRACTION_PROMPT"""
+    memories: List[ExtractedMemory] = []
+
+
+class BatchExtractionResult(msgspec.Struct):
+    """Reply schema of EXTRACTION_BATCH_PROMPT"""
+    results: List[ExtractionResult] = []
+
+
+_Reply = TypeVar("_Reply", ExtractionResult, BatchExtractionResult)
+
+render_extraction_prompt = compile_template(EXTRACTION_PROMPT)
+render_extraction_batch_prompt = compile_template(EXTRACTION_BATCH_PROMPT)
+
+
+def _may_contain_personal_info(user_message: str) -> bool:
+    """
+    Cheap pre-filter for auto_extract_memory
+
+    Only English cues are known, so non-ASCII messages always pass.
+    """
+    return not user_message.isascii() or _SIGNAL_RE.search(user_message) is not None
+
+
+async def _complete_json(
+    prompt: str, api_key: str, max_tokens: int, reply_type: Type[_Reply]
+) -> Optional[_Reply]:
+    """
+    Ask the extraction model and decode the JSON object in its reply
+
+    Decoding and schema validation happen in one msgspec pass (strict=False
+    accepts e.g. "7" for an int field). At most EXTRACTION_CONCURRENCY of
+    these calls are in flight at once.
+
+    Returns:
+        The decoded reply, or None if it contains no JSON object
+    """
+    async with _extract_semaphore:
         response = await litellm.acompletion(
             model="gemini/gemini-2.0-flash",
             messages=[{"role": "user", "content": prompt}],
             temperature=0,
             custom_llm_provider="gemini",
-            max_tokens=500,
+            api_key=api_key,
+            max_tokens=max_tokens,
         )
-        
-        result_text = response.choices[0].message.content
-        if not result_text:
-            return False
-        
-        result_text = result_text.strip()
-        
-        # Try to extract JSON from the response
-        try:
-            # Handle markdown code blocks
-            if "```json" in result_text:
-                result_text = result_text.split("```json")[1].split("```")[0].strip()
-            elif "```" in result_text:
-                result_text = result_text.split("```")[1].split("```")[0].strip()
-            
-            data = json.loads(result_text)
-        except json.JSONDecodeError:
-            # Fallback: try to find start and end of JSON object
-            start_idx = result_text.find("{")
-            end_idx = result_text.rfind("}")
-            if start_idx != -1 and end_idx != -1:
-                json_str = result_text[start_idx:end_idx+1]
-                data = json.loads(json_str)
-            else:
-                return False
-        
-        memories = data.get("memories", [])
-        if not memories:
-            return False
-            
-        saved_count = 0
-        for item in memories:
-            if item.get("key") and item.get("value"):
-                profile.add_entry(
-                    category=item.get("category", "personal"),
-                    key=item.get("key"),
-                    value=item.get("value"),
-                    source="auto_extracted",
-                    importance=item.get("importance", 5)
-                )
-                logger.info(f"Auto-saved memory: {item.get('key')}")
-                saved_count += 1
-                
-        return saved_count > 0
     
-    except Exception as e:
-        logger.error(f"Memory extraction failed: {e}")
+    result_text = response.choices[0].message.content
+    if not result_text:
+        return None
+    
+    # Extract the JSON object from the response in one scan
+    match = _JSON_BLOCK_RE.search(result_text)
+    if not match:
+        return None
+    return msgspec.json.decode(match.group(1) or match.group(2), type=reply_type, strict=False)
+
+
+def _importance(value: Union[int, str, None]) -> int:
+    """Importance as an int; non-numeric or missing values get the default 5"""
+    if isinstance(value, int):
+        return value
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 5
+
+
+def _new_memory_entries(memories: List[ExtractedMemory]) -> List[dict]:
+    """Profile entries for the usable extracted memories (key and value set)"""
+    return [
+        {
+            "category": item.category or "personal",
+            "key": item.key,
+            "value": item.value,
+            "source": "auto_extracted",
+            "importance": _importance(item.importance),
+        }
+        for item in memories
+        if item.key and item.value
+    ]
+
+
+async def _save_entries(batch: List[dict]) -> List[bool]:
+    """
+    Write entries to the profile off the event loop
+
+    Facts already in the profile (e.g. the user restating their name) are
+    skipped.
+
+    Returns:
+        Per entry, whether it was saved
+    """
+    if not batch:
+        return []
+    entry_ids = await profile.aadd_entries(batch, skip_existing=True)
+    saved = [entry["key"] for entry, entry_id in zip(batch, entry_ids) if entry_id is not None]
+    if saved:
+        logger.info(f"Auto-saved {len(saved)} memories: {', '.join(saved)}")
+    return [entry_id is not None for entry_id in entry_ids]
+
+
+async def auto_extract_memory(user_message: str, ai_response: str, api_key: str) -> bool:
+    """
+    Automatically extract and save memory from conversation
+    
+    Returns True if memory was saved
+    """
+    if not _may_contain_personal_info(user_message):
+        logger.debug("Skipping memory extraction: no personal-info cues in message")
         return False
+
+    try:
+        data = await _complete_json(
+            render_extraction_prompt(user_message=user_message, ai_response=ai_response),
+            api_key,
+            max_tokens=500,
+            reply_type=ExtractionResult,
+        )
+        if data is None:
+            return False
+        return any(await _save_entries(_new_memory_entries(data.memories)))
     
-    except json.JSONDecodeError as e:
+    except msgspec.DecodeError as e:
         logger.warning(f"Memory extraction JSON parse failed: {e}")
         return False
     except Exception as e:
         logger.error(f"Memory extraction failed: {e}")
         return False
+
+
+_BatchItem = Tuple[str, str, str, "asyncio.Future[bool]"]  # user_message, ai_response, api_key, result
+
+
+class ExtractionBatcher:
+    """
+    Micro-batcher for memory extraction
+
+    Turns submitted within a short window are packed into one extraction call
+    (per API key) whose prompt lists them as numbered conversations. A lone
+    turn, or a batch whose reply can't be split, uses auto_extract_memory.
+    """
+
+    def __init__(self, window_ms: int, max_batch: int):
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._queue: Optional["asyncio.Queue[_BatchItem]"] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    async def submit(self, user_message: str, ai_response: str, api_key: str) -> bool:
+        """Queue a turn for extraction and wait for its result"""
+        if not _may_contain_personal_info(user_message):
+            logger.debug("Skipping memory extraction: no personal-info cues in message")
+            return False
+
+        if self._worker is None or self._worker.done():
+            # A restarted worker keeps the existing queue, so turns queued
+            # before the old one stopped are still processed
+            if self._queue is None:
+                self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+
+        future: "asyncio.Future[bool]" = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((user_message, ai_response, api_key, future))
+        return await future
+
+    async def _run(self) -> None:
+        """Collect turns for up to one window, then dispatch them grouped by API key"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch: List[_BatchItem] = [await self._queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            groups: Dict[str, List[_BatchItem]] = {}
+            for item in batch:
+                groups.setdefault(item[2], []).append(item)
+            for items in groups.values():
+                task = asyncio.create_task(self._process(items))
+                _pending_extractions.add(task)
+                task.add_done_callback(_pending_extractions.discard)
+
+    async def _process(self, items: List[_BatchItem]) -> None:
+        """
+        Extract one group (same API key) and resolve every caller's future
+
+        An error that escapes extraction (e.g. the profile write failing)
+        fails every future in the group.
+        """
+        try:
+            if len(items) == 1:
+                user_message, ai_response, api_key, _ = items[0]
+                results = [await auto_extract_memory(user_message, ai_response, api_key)]
+            else:
+                results = await self._extract_batch(items)
+        except Exception as e:
+            for _, _, _, future in items:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for (_, _, _, future), saved in zip(items, results):
+                if not future.done():
+                    future.set_result(saved)
+        finally:
+            for _, _, _, future in items:
+                if not future.done():
+                    future.cancel()
+
+    async def _extract_batch(self, items: List[_BatchItem]) -> List[bool]:
+        """
+        One extraction call for several turns
+
+        Falls back to per-turn calls only if the batched call or its reply
+        fails; a failed profile write is raised (retrying extraction would
+        hit the same write error).
+        """
+        conversations = "\n\n".join(
+            f"CONVERSATION {i}:\nUser: {user_message}\nAI: {ai_response}"
+            for i, (user_message, ai_response, _, _) in enumerate(items, 1)
+        )
+        try:
+            data = await _complete_json(
+                render_extraction_batch_prompt(conversations=conversations),
+                items[0][2],
+                max_tokens=500 * len(items),
+                reply_type=BatchExtractionResult,
+            )
+        except Exception as e:
+            logger.warning(f"Batched memory extraction failed, retrying per turn: {e}")
+        else:
+            if data is not None and len(data.results) == len(items):
+                logger.info(f"Batched memory extraction for {len(items)} turns")
+                batches = [_new_memory_entries(result.memories) for result in data.results]
+                # One profile write for the whole batch
+                saved = iter(await _save_entries([entry for batch in batches for entry in batch]))
+                return [any([next(saved) for _ in batch]) for batch in batches]
+            logger.warning("Batched extraction reply did not match the batch; retrying per turn")
+
+        return list(await asyncio.gather(*(
+            auto_extract_memory(user_message, ai_response, api_key)
+            for user_message, ai_response, api_key, _ in items
+        )))
+
+
+def schedule_extract_memory(user_message: str, ai_response: str, api_key: str) -> asyncio.Task:
+    """
+    Run memory extraction in the background and return immediately
+
+    Turns are micro-batched by extraction_batcher; at most
+    EXTRACTION_CONCURRENCY extraction calls run at once. Must be called from
+    a running event loop.
+
+    Returns:
+        The background task (resolves to True if any memory was saved)
+    """
+    task = asyncio.create_task(extraction_batcher.submit(user_message, ai_response, api_key))
+    _pending_extractions.add(task)
+    task.add_done_callback(_extraction_done)
+    return task
+
+
+def _extraction_done(task: asyncio.Task) -> None:
+    """Drop a finished extraction task's reference and log its failure, if any"""
+    _pending_extractions.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Memory extraction failed: {task.exception()}")
+
+
+# Global instance
+extraction_batcher = ExtractionBatcher(EXTRACTION_BATCH_WINDOW_MS, EXTRACTION_MAX_BATCH)
@@ -1,16 +1,75 @@
-from typing import AsyncGenerator, List, Dict, Any
-import os
+from functools import lru_cache
+from typing import AsyncGenerator, AsyncIterator, Callable, List, Dict, Any, Optional, Tuple
+import asyncio
 import logging
 import re
+import time
 
+import httpx
 import litellm
+import orjson
 
 
 logger = logging.getLogger(__name__)
 
+# generate_stream coalesces content deltas: flush after this many deltas or
+# once this much time has passed since the last flush (a timer, so a pause in
+# the model's output never holds back text it has already produced)
+_BATCH_N = 8
+_BATCH_MS = 50
+
+# TagParser tags (module constants: plain LOAD_GLOBAL in the hot loop, no
+# per-instance attribute lookups or len() calls)
+_THINKING_OPEN_VARIANTS = ("<thinking>", "<think>")
+_THINKING_CLOSE_VARIANTS = ("</thinking>", "</think>")
+_ANSWER_OPEN = "<answer>"
+_ANSWER_CLOSE = "</answer>"
+_ANSWER_CLOSE_LEN = len(_ANSWER_CLOSE)
+_THINKING_CLOSE_MAX_LEN = max(len(t) for t in _THINKING_CLOSE_VARIANTS)
+_MAX_TAG_LEN = max(
+    len(_ANSWER_OPEN), _ANSWER_CLOSE_LEN,
+    *(len(t) for t in _THINKING_OPEN_VARIANTS),
+    _THINKING_CLOSE_MAX_LEN,
+)
+
+
+def _tag_pattern(tags: Tuple[str, ...]) -> str:
+    """Regex alternation matching any of the literal tags (longest first)"""
+    return "|".join(re.escape(tag) for tag in sorted(tags, key=len, reverse=True))
+
+
+# TagParser tag detection, generated once from the tag tables above: one
+# C-level scan finds the earliest tag of interest. Group 1 is set only for
+# <answer>, so match.lastindex tells thinking and answer apart.
+_OPEN_TAG_RE = re.compile(f"({re.escape(_ANSWER_OPEN)})|{_tag_pattern(_THINKING_OPEN_VARIANTS)}")
+_THINKING_CLOSE_RE = re.compile(_tag_pattern(_THINKING_CLOSE_VARIANTS))
+
+# Tag fragments stripped from the ends of flushed text: any run of complete or
+# partial tags and bare "answer"/"thinking" words (case-insensitive), in one
+# anchored pass per end, plus the complete tags removed anywhere
+_TAG_ARTIFACT = r"(?:</?(?:answer|thinking)>?|answer|thinking)"
+_EDGE_ARTIFACTS_RE = re.compile(
+    rf"\A(?:\s*{_TAG_ARTIFACT})+|(?:{_TAG_ARTIFACT}\s*)+\Z", re.IGNORECASE
+)
+_TAG_ARTIFACT_RE = re.compile(r"</?(?:answer|thinking)>", re.IGNORECASE)
+
+# TagParser states (small ints: cheap to compare, usable as table indexes)
+_OUTSIDE, _IN_THINKING, _IN_ANSWER = 0, 1, 2
+
+# Per-state tables for the in-section states, indexed by state id
+_SECTION_NAMES = (None, "thinking", "answer")
+_CLOSE_TAG_RES = (None, _THINKING_CLOSE_RE, re.compile(re.escape(_ANSWER_CLOSE)))
+_CLOSE_LOOKAHEAD = (None, _THINKING_CLOSE_MAX_LEN, _ANSWER_CLOSE_LEN)  # Chars held back for a partial close tag
+
 # Configure LiteLLM
 litellm.drop_params = True  # Ignore provider-specific params
 litellm.set_verbose = False  # Reduce logging noise
+# One keep-alive pool for every acompletion call in the process (chat streams,
+# router, titles, memory extraction), so follow-up calls reuse warm connections
+litellm.aclient_session = httpx.AsyncClient(
+    limits=httpx.Limits(max_keepalive_connections=100, max_connections=200),
+    timeout=60,
+)
 
 
 class TagParser:
@@ -20,202 +79,135 @@ class TagParser:
     """
     
     def __init__(self):
-        self.state = "outside"  # outside, in_thinking, in_answer
+        self.state = _OUTSIDE  # _OUTSIDE, _IN_THINKING or _IN_ANSWER
         self.buffer = ""  # Main buffer for accumulating content
-        self.current_content = ""  # Content being accumulated for current section
         self.has_yielded_answer = False  # Track if we've yielded any answer content
-        # Tag definitions
-        self.THINKING_OPEN_VARIANTS = ["<thinking>", "<think>"]
-        self.THINKING_CLOSE_VARIANTS = ["</thinking>", "</think>"]
-        
-        # Primary tags for logic (we'll normalize to these or check variants)
-        self.THINKING_OPEN = "<thinking>" 
-        self.THINKING_CLOSE = "</thinking>"
-        self.ANSWER_OPEN = "<answer>"
-        self.ANSWER_CLOSE = "</answer>"
-        
-        # Calculate max tag len based on all variants
-        self.MAX_TAG_LEN = max(
-            len(self.ANSWER_OPEN), len(self.ANSWER_CLOSE),
-            *[len(t) for t in self.THINKING_OPEN_VARIANTS],
-            *[len(t) for t in self.THINKING_CLOSE_VARIANTS]
-        )
     
-    def process_chunk(self, chunk: str) -> List[Dict[str, str]]:
+    def process_chunk(self, chunk: str) -> List[Tuple[str, str]]:
         """
         Process chunk and return list of parsed sections.
         Streams content incrementally as it's parsed.
+        
+        Returns:
+            (section, content) tuples; section is "thinking" or "answer"
         """
         if not chunk:
             return []
         
-        results = []
-        self.buffer += chunk
+        results: List[Tuple[str, str]] = []
+        append = results.append
+        # The carried-over tail is at most one tag long, so this copies O(chunk)
+        buf = self.buffer + chunk if self.buffer else chunk
+        
+        state = self.state
+        
+        if "<" not in buf:
+            # Fast path for the common chunk with no tag anywhere (mid-section
+            # text, untagged output): nothing to scan, just hold back the
+            # lookahead tail and yield the rest in one piece
+            if state == _OUTSIDE:
+                safe_end = len(buf) - _MAX_TAG_LEN
+                section = "answer"
+            else:
+                safe_end = len(buf) - _CLOSE_LOOKAHEAD[state]
+                section = _SECTION_NAMES[state]
+            if safe_end <= 0:
+                self.buffer = buf
+                return results
+            self.buffer = buf[safe_end:]
+            content_to_yield = buf[:safe_end]
+            if state == _OUTSIDE and content_to_yield.isspace():
+                return results
+            if section == "answer":
+                self.has_yielded_answer = True
+            append((section, content_to_yield))
+            return results
+        
+        pos = 0  # Scan cursor: buf[:pos] is consumed; buf is only sliced once at the end
+        debug = logger.isEnabledFor(logging.DEBUG)
         
         # Process buffer until no more complete tags are found
         while True:
             made_progress = False
             
-            if self.state == "outside":
-                # Find earliest occurrence of any thinking open tag
-                thinking_start = -1
-                matched_thinking_tag = ""
-                for tag in self.THINKING_OPEN_VARIANTS:
-                    pos = self.buffer.find(tag)
-                    if pos != -1:
-                        if thinking_start == -1 or pos < thinking_start:
-                            thinking_start = pos
-                            matched_thinking_tag = tag
-
-                answer_start = self.buffer.find(self.ANSWER_OPEN)
+            if state == _OUTSIDE:
+                # Find the earliest opening tag (any thinking variant or <answer>)
+                match = _OPEN_TAG_RE.search(buf, pos)
                 
-                # Determine which tag comes first
-                if thinking_start != -1 and (answer_start == -1 or thinking_start < answer_start):
-                    # Found thinking tag first
-                    if thinking_start > 0:
+                if match:
+                    tag_start = match.start()
+                    if tag_start > pos:
                         # Content before tag - treat as answer (fallback)
-                        pre_content = self.buffer[:thinking_start].strip()
+                        pre_content = buf[pos:tag_start].strip()
                         if pre_content:
-                            results.append({"section": "answer", "content": pre_content})
+                            append(("answer", pre_content))
                             self.has_yielded_answer = True
-                            logger.info(f"TagParser: Found content before thinking tag, yielding as answer ({len(pre_content)} chars)")
+                            if debug:
+                                logger.debug(f"TagParser: Found content before {match.group()} tag, yielding as answer ({len(pre_content)} chars)")
                     
-                    # Strip the tag and switch to thinking mode
-                    self.buffer = self.buffer[thinking_start + len(matched_thinking_tag):]
-                    self.state = "in_thinking"
-                    self.current_content = ""
-                    logger.info(f"TagParser: Switching to THINKING mode (found {matched_thinking_tag})")
-                    made_progress = True
-                    
-                elif answer_start != -1:
-                    # Found <answer> first
-                    if answer_start > 0:
-                        # Content before tag - treat as answer (fallback)
-                        pre_content = self.buffer[:answer_start].strip()
-                        if pre_content:
-                            results.append({"section": "answer", "content": pre_content})
-                            self.has_yielded_answer = True
-                            logger.info(f"TagParser: Found content before <answer> tag, yielding as answer ({len(pre_content)} chars)")
-                    
-                    # Strip the tag and switch to answer mode
-                    self.buffer = self.buffer[answer_start + len(self.ANSWER_OPEN):]
-                    self.state = "in_answer"
-                    self.current_content = ""
-                    logger.info("TagParser: Switching to ANSWER mode")
+                    # Skip past the tag and switch to thinking/answer mode
+                    pos = match.end()
+                    state = _IN_ANSWER if match.lastindex else _IN_THINKING
+                    if debug:
+                        logger.debug(f"TagParser: Switching to {'ANSWER' if state == _IN_ANSWER else 'THINKING'} mode (found {match.group()})")
                     made_progress = True
                 else:
-                    # No complete tags found - check if buffer ends with partial tag
-                    safe_to_yield_len = len(self.buffer) - self.MAX_TAG_LEN
-                    if safe_to_yield_len > 0:
-                        # Check if the end of buffer could be start of a tag
-                        buffer_end = self.buffer[-self.MAX_TAG_LEN:]
-                        could_be_tag = False
-                        
-                        # Check if buffer end matches start of any opening tag
-                        if self.ANSWER_OPEN.startswith(buffer_end):
-                            could_be_tag = True
-                        else:
-                            for tag in self.THINKING_OPEN_VARIANTS:
-                                if tag.startswith(buffer_end):
-                                    could_be_tag = True
-                                    break
-                        
-                        if not could_be_tag:
-                            # Safe to yield content
-                            content_to_yield = self.buffer[:safe_to_yield_len]
-                            if content_to_yield.strip():
-                                results.append({"section": "answer", "content": content_to_yield})
-                                self.has_yielded_answer = True
+                    # No complete tags found - yield all but the last
+                    # _MAX_TAG_LEN chars, which may hold a partial opening tag
+                    # (any partial tag is shorter than that tail, so no prefix
+                    # check on the tail is needed)
+                    safe_end = len(buf) - _MAX_TAG_LEN
+                    if safe_end > pos:
+                        content_to_yield = buf[pos:safe_end]
+                        if content_to_yield.strip():
+                            append(("answer", content_to_yield))
+                            self.has_yielded_answer = True
+                            if debug:
                                 logger.debug(f"TagParser: Yielding buffered content as answer ({len(content_to_yield)} chars)")
-                            self.buffer = self.buffer[safe_to_yield_len:]  # Keep last MAX_TAG_LEN chars
-                    break
-            
-            elif self.state == "in_thinking":
-                # Look for any closing tag variant
-                thinking_end = -1
-                matched_closing_tag = ""
-                for tag in self.THINKING_CLOSE_VARIANTS:
-                    pos = self.buffer.find(tag)
-                    if pos != -1:
-                        if thinking_end == -1 or pos < thinking_end:
-                            thinking_end = pos
-                            matched_closing_tag = tag
-                
-                if thinking_end != -1:
-                    # Found closing tag - yield remaining content
-                    content_to_yield = self.buffer[:thinking_end]
-                    if content_to_yield:
-                        results.append({"section": "thinking", "content": content_to_yield})
-                        logger.info(f"TagParser: Exiting THINKING mode, yielded {len(content_to_yield)} chars")
-                    
-                    # Strip closing tag and switch back to outside
-                    self.buffer = self.buffer[thinking_end + len(matched_closing_tag):]
-                    self.state = "outside"
-                    self.current_content = ""
-                    made_progress = True
-                else:
-                    # No closing tag yet - check if we can safely yield partial content
-                    # We need to be careful not to split a potential closing tag
-                    # Use the longest closing tag variant for safety margin
-                    max_close_len = max(len(t) for t in self.THINKING_CLOSE_VARIANTS)
-                    safe_to_yield_len = len(self.buffer) - max_close_len
-                    
-                    if safe_to_yield_len > 0:
-                        # Check if buffer end could be start of closing tag
-                        buffer_end = self.buffer[-max_close_len:]
-                        could_be_closing = False
-                        for tag in self.THINKING_CLOSE_VARIANTS:
-                            if tag.startswith(buffer_end):
-                                could_be_closing = True
-                                break
-                        
-                        if not could_be_closing:
-                            # Safe to yield - yield only the new portion
-                            content_to_yield = self.buffer[:safe_to_yield_len]
-                            if content_to_yield:
-                                results.append({"section": "thinking", "content": content_to_yield})
-                                logger.debug(f"TagParser: Yielding partial thinking content ({len(content_to_yield)} chars)")
-                            self.buffer = self.buffer[safe_to_yield_len:]
+                        pos = safe_end  # Keep last MAX_TAG_LEN chars
                     break
             
-            elif self.state == "in_answer":
-                # Look for </answer> closing tag
-                answer_end = self.buffer.find(self.ANSWER_CLOSE)
+            else:
+                # Inside <thinking> or <answer>: look for that section's closing tag
+                section = _SECTION_NAMES[state]
+                match = _CLOSE_TAG_RES[state].search(buf, pos)
                 
-                if answer_end != -1:
+                if match:
                     # Found closing tag - yield remaining content
-                    content_to_yield = self.buffer[:answer_end]
+                    content_to_yield = buf[pos:match.start()]
                     if content_to_yield:
-                        results.append({"section": "answer", "content": content_to_yield})
-                        self.has_yielded_answer = True
-                        logger.info(f"TagParser: Exiting ANSWER mode, yielded {len(content_to_yield)} chars")
+                        append((section, content_to_yield))
+                        if state == _IN_ANSWER:
+                            self.has_yielded_answer = True
+                        if debug:
+                            logger.debug(f"TagParser: Exiting {section.upper()} mode, yielded {len(content_to_yield)} chars")
                     
-                    # Strip closing tag and switch back to outside
-                    self.buffer = self.buffer[answer_end + len(self.ANSWER_CLOSE):]
-                    self.state = "outside"
-                    self.current_content = ""
+                    # Skip past closing tag and switch back to outside
+                    pos = match.end()
+                    state = _OUTSIDE
                     made_progress = True
                 else:
-                    # No closing tag yet - check if we can safely yield partial content
-                    safe_to_yield_len = len(self.buffer) - len(self.ANSWER_CLOSE)
-                    if safe_to_yield_len > 0:
-                        # Check if buffer end could be start of closing tag
-                        buffer_end = self.buffer[-len(self.ANSWER_CLOSE):]
-                        could_be_closing = self.ANSWER_CLOSE.startswith(buffer_end)
-                        
-                        if not could_be_closing:
-                            # Safe to yield - yield only the new portion
-                            content_to_yield = self.buffer[:safe_to_yield_len]
-                            if content_to_yield:
-                                results.append({"section": "answer", "content": content_to_yield})
-                                self.has_yielded_answer = True
-                                logger.debug(f"TagParser: Yielding partial answer content ({len(content_to_yield)} chars)")
-                            self.buffer = self.buffer[safe_to_yield_len:]  # Keep last chars for lookahead
+                    # No closing tag yet - yield all but the last few chars, which
+                    # may hold a partial closing tag. The tail itself needs no
+                    # re-check: it was just searched, and a tail as long as the
+                    # longest closing tag could only be a tag prefix by being the
+                    # complete tag.
+                    safe_end = len(buf) - _CLOSE_LOOKAHEAD[state]
+                    if safe_end > pos:
+                        content_to_yield = buf[pos:safe_end]
+                        append((section, content_to_yield))
+                        if state == _IN_ANSWER:
+                            self.has_yielded_answer = True
+                        if debug:
+                            logger.debug(f"TagParser: Yielding partial {section} content ({len(content_to_yield)} chars)")
+                        pos = safe_end
                     break
             
             if not made_progress:
                 break
         
+        self.buffer = buf[pos:] if pos else buf
+        self.state = state
         return results
     
     def _clean_tag_artifacts(self, text: str) -> str:
@@ -232,98 +224,184 @@ class TagParser:
         if not text:
             return ""
         
-        cleaned = text.strip()
-        
-        # Remove closing tags that might have leaked
-        tag_artifacts = [
-            "</answer>",
-            "</thinking>",
-            "<answer>",
-            "<thinking>",
-            "</answer",
-            "</thinking",
-            "<answer",
-            "<thinking",
-            "ANSWER",
-            "THINKING",
-        ]
-        
         # Remove artifacts from start and end
-        for artifact in tag_artifacts:
-            # Remove from start (case-insensitive)
-            while cleaned.lower().startswith(artifact.lower()):
-                cleaned = cleaned[len(artifact):].strip()
-            # Remove from end (case-insensitive)
-            while cleaned.lower().endswith(artifact.lower()):
-                cleaned = cleaned[:-len(artifact)].strip()
+        cleaned = _EDGE_ARTIFACTS_RE.sub('', text.strip()).strip()
         
         # Remove any remaining tag-like patterns at boundaries
         # Remove patterns like "</answer>" or "<answer>" anywhere if they're standalone
-        cleaned = re.sub(r'</?(?:answer|thinking)>', '', cleaned, flags=re.IGNORECASE)
+        cleaned = _TAG_ARTIFACT_RE.sub('', cleaned)
         cleaned = cleaned.strip()
         
         return cleaned
     
-    def flush(self) -> List[Dict[str, str]]:
+    def flush(self) -> List[Tuple[str, str]]:
         """
         Flush remaining buffer content.
         Call this at the end of streaming to yield any remaining content.
         
         RESCUE LOGIC: If stream ends in THINKING state and no answer was yielded,
         treat the buffer as answer to ensure user sees content.
+        
+        Returns:
+            (section, content) tuples, as from process_chunk
         """
-        results = []
+        results: List[Tuple[str, str]] = []
+        buffer = self.buffer
         
-        # Yield any accumulated content for current section
-        if self.state == "in_thinking" and (self.current_content or self.buffer):
-            remaining = (self.current_content + self.buffer).strip()
-            if remaining:
+        # Yield any remaining content for the current section; the buffer is
+        # cleaned once (_clean_tag_artifacts strips it itself)
+        if buffer and not buffer.isspace():
+            cleaned = self._clean_tag_artifacts(buffer)
+            
+            if self.state == _IN_THINKING and not self.has_yielded_answer:
                 # RESCUE: If we haven't yielded any answer yet, treat this as answer
                 # (Model forgot to close thinking tag and switch to answer)
-                if not self.has_yielded_answer:
-                    # Clean tag artifacts before yielding
-                    cleaned = self._clean_tag_artifacts(remaining)
-                    if cleaned:  # Only yield if there's content after cleaning
-                        results.append({"section": "answer", "content": cleaned})
-                        self.has_yielded_answer = True
-                        logger.warning(f"TagParser: Stream ended in THINKING mode. Rescuing buffer as ANSWER ({len(cleaned)} chars after cleaning)")
-                    else:
-                        logger.warning(f"TagParser: Rescued buffer was empty after cleaning tag artifacts, not yielding")
+                if cleaned:  # Only yield if there's content after cleaning
+                    results.append(("answer", cleaned))
+                    self.has_yielded_answer = True
+                    logger.warning(f"TagParser: Stream ended in THINKING mode. Rescuing buffer as ANSWER ({len(cleaned)} chars after cleaning)")
                 else:
+                    logger.warning(f"TagParser: Rescued buffer was empty after cleaning tag artifacts, not yielding")
+            elif cleaned:
+                if self.state == _IN_THINKING:
                     # We already have answer content, so this is truly thinking
-                    cleaned = self._clean_tag_artifacts(remaining)
-                    if cleaned:
-                        results.append({"section": "thinking", "content": cleaned})
-                        logger.info(f"TagParser: Flushing remaining thinking content ({len(cleaned)} chars)")
-        elif self.state == "in_answer" and (self.current_content or self.buffer):
-            remaining = (self.current_content + self.buffer).strip()
-            if remaining:
-                # Clean tag artifacts
-                cleaned = self._clean_tag_artifacts(remaining)
-                if cleaned:
-                    results.append({"section": "answer", "content": cleaned})
-                    self.has_yielded_answer = True
-                    logger.info(f"TagParser: Flushing remaining answer content ({len(cleaned)} chars)")
-        elif self.buffer:
-            # Outside tags but have content - default to answer
-            remaining = self.buffer.strip()
-            if remaining:
-                # Clean tag artifacts
-                cleaned = self._clean_tag_artifacts(remaining)
-                if cleaned:
-                    results.append({"section": "answer", "content": cleaned})
+                    results.append(("thinking", cleaned))
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug(f"TagParser: Flushing remaining thinking content ({len(cleaned)} chars)")
+                else:
+                    # Inside <answer>, or outside tags (default to answer)
+                    results.append(("answer", cleaned))
                     self.has_yielded_answer = True
-                    logger.info(f"TagParser: Flushing remaining content as answer ({len(cleaned)} chars)")
+                    if logger.isEnabledFor(logging.DEBUG):
+                        where = "answer content" if self.state == _IN_ANSWER else "content as answer"
+                        logger.debug(f"TagParser: Flushing remaining {where} ({len(cleaned)} chars)")
         
         # Reset state
         self.buffer = ""
-        self.current_content = ""
-        self.state = "outside"
+        self.state = _OUTSIDE
         self.has_yielded_answer = False
         
         return results
 
 
+@lru_cache(maxsize=64)
+def _resolve_provider(model: str) -> Optional[str]:
+    """custom_llm_provider to force for a model name (None lets LiteLLM infer it)"""
+    if "gemini" in model.lower():
+        return "gemini"  # Explicit provider - forces Gemini API
+    return None
+
+
+def _dict_delta_fields(delta: Dict[str, Any]) -> Tuple[Any, Any]:
+    """(thinking, content) of a dict stream delta; missing fields are falsy"""
+    get = delta.get
+    return get("thinking") or get("thought"), get("content")
+
+
+def _attr_delta_fields(delta: Any) -> Tuple[Any, Any]:
+    """(thinking, content) of an object stream delta; missing fields are falsy"""
+    return (
+        getattr(delta, "thinking", None) or getattr(delta, "thought", None),
+        getattr(delta, "content", None),
+    )
+
+
+class _DeltaStream:
+    """
+    Core LLM streaming loop shared by generate_stream and generate_stream_frames
+
+    A hand-rolled async iterator rather than an async generator, so each of
+    the thousands of deltas in a long answer is a plain coroutine call instead
+    of a round trip through the generator's asend machinery.
+
+    Yields:
+        (type, text) tuples; type is "thinking" or "content"
+    """
+
+    __slots__ = (
+        "_kwargs", "_model", "_response", "_pending", "_chunk_count", "_debug", "_done", "_fields",
+    )
+
+    def __init__(
+        self,
+        messages: List[Dict[str, Any]],
+        model: str,
+        api_key: str,
+        temperature: float,
+        max_tokens: int,
+    ):
+        # The key is passed per call (never via os.environ), so concurrent
+        # streams for different providers can't clobber each other's keys
+        self._kwargs: Dict[str, Any] = {
+            "model": model,
+            "messages": messages,
+            "stream": True,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "api_key": api_key,
+        }
+        # Add explicit provider for Gemini models
+        custom_provider = _resolve_provider(model)
+        if custom_provider:
+            self._kwargs["custom_llm_provider"] = custom_provider
+
+        self._model = model
+        self._response: Optional[AsyncIterator[Any]] = None  # Opened on first __anext__
+        self._pending: Optional[Tuple[str, str]] = None  # Content that arrived with a thinking delta
+        self._chunk_count = 0
+        self._debug = logger.isEnabledFor(logging.DEBUG)  # Checked once, not per chunk
+        self._done = False
+        # Delta field extractor, picked on the first chunk: deltas are objects
+        # or dicts depending on the provider, but one stream never mixes them.
+        # Native thinking (Gemini 3 Pro) arrives as "thinking" or "thought".
+        self._fields: Optional[Callable[[Any], Tuple[Any, Any]]] = None
+
+    def __aiter__(self) -> "_DeltaStream":
+        return self
+
+    async def __anext__(self) -> Tuple[str, str]:
+        if self._pending is not None:
+            pending, self._pending = self._pending, None
+            return pending
+        if self._done:
+            raise StopAsyncIteration
+
+        try:
+            if self._response is None:
+                logger.info(f"Starting stream with model: {self._model}")
+                response = await litellm.acompletion(**self._kwargs)
+                self._response = response.__aiter__()
+
+            while True:
+                chunk = await self._response.__anext__()
+                self._chunk_count += 1
+                delta = chunk.choices[0].delta
+
+                if self._fields is None:
+                    self._fields = _dict_delta_fields if isinstance(delta, dict) else _attr_delta_fields
+                thinking_content, content = self._fields(delta)
+
+                if thinking_content:
+                    if self._debug:
+                        logger.debug(f"Yielding thinking chunk ({len(thinking_content)} chars)")
+                    if content:
+                        self._pending = ("content", content)
+                    return "thinking", thinking_content
+                if content:
+                    if self._debug:
+                        logger.debug(f"Yielding content chunk ({len(content)} chars)")
+                    return "content", content
+
+        except StopAsyncIteration:
+            self._done = True
+            logger.info(f"Streaming complete. Total chunks processed: {self._chunk_count}")
+            raise
+        except Exception as e:
+            self._done = True
+            logger.error(f"LLM streaming error: {e}", exc_info=True)
+            return "content", f"\n\n[Error: {str(e)}]"
+
+
 async def generate_stream(
     messages: List[Dict[str, Any]],
     model: str,
@@ -335,7 +413,7 @@ async def generate_stream(
     Generate streaming response from LLM
 
     Yields dicts with type ("thinking" or "content") and content.
-    For Gemini 3 Pro, uses native thinking mode via thinkingConfig.
+    Native thinking deltas (e.g. Gemini 3 Pro) are passed through as "thinking".
 
     Args:
         messages: List of message dicts with role and content
@@ -345,130 +423,96 @@ async def generate_stream(
         max_tokens: Maximum response length
 
     Yields:
-        Dict with "type" ("thinking" or "content") and "content" (text chunk)
+        Dict with "type" ("thinking" or "content") and "content" (text chunk).
+        Consecutive content deltas are coalesced (up to _BATCH_N deltas or
+        _BATCH_MS milliseconds per chunk, whichever comes first, even if no
+        further delta arrives); the first delta is never held back.
     """
+    buffer: List[str] = []
+    last_flush = 0.0  # Forces the first content delta out immediately
+    batch_seconds = _BATCH_MS / 1000
+    deltas = _DeltaStream(messages, model, api_key, temperature, max_tokens)
+    next_delta: Optional[asyncio.Future] = None  # Pending read while content is buffered
+
     try:
-        # Set appropriate API key
-        if "gpt" in model.lower() or "o1" in model.lower():
-            os.environ["OPENAI_API_KEY"] = api_key
-            custom_provider = None
-        elif "claude" in model.lower():
-            os.environ["ANTHROPIC_API_KEY"] = api_key
-            custom_provider = None
-        elif "gemini" in model.lower():
-            os.environ["GOOGLE_API_KEY"] = api_key
-            custom_provider = "gemini"  # Explicit provider - forces Gemini API
-        else:
-            custom_provider = None
-
-        logger.info(f"Starting stream with model: {model}")
-
-        # Build completion kwargs
-        completion_kwargs = {
-            "model": model,
-            "messages": messages,
-            "stream": True,
-            "temperature": temperature,
-            "max_tokens": max_tokens,
-        }
-        
-        # Add explicit provider for Gemini models
-        if custom_provider:
-            completion_kwargs["custom_llm_provider"] = custom_provider
+        while True:
+            if buffer:
+                # Wait for the next delta only until the batch window closes;
+                # asyncio.wait (unlike wait_for) leaves the read running
+                if next_delta is None:
+                    next_delta = asyncio.ensure_future(anext(deltas, None))
+                remaining = last_flush + batch_seconds - time.monotonic()
+                if remaining > 0:
+                    await asyncio.wait((next_delta,), timeout=remaining)
+                if not next_delta.done():
+                    yield {"type": "content", "content": "".join(buffer)}
+                    buffer.clear()
+                    last_flush = time.monotonic()
+                    continue
+                item = next_delta.result()
+                next_delta = None
+            elif next_delta is not None:
+                item = await next_delta
+                next_delta = None
+            else:
+                item = await anext(deltas, None)
 
-        response = await litellm.acompletion(**completion_kwargs)
+            if item is None:
+                break
+            chunk_type, text = item
 
-        chunk_count = 0
-        async for chunk in response:
-            chunk_count += 1
-            delta = chunk.choices[0].delta
-            
-            # DEBUG: Log delta structure for Gemini 3 Pro
-            if model == "gemini-3-pro-preview" and chunk_count <= 5:
-                logger.info(f"=== Chunk #{chunk_count} Debug ===")
-                logger.info(f"Delta type: {type(delta)}")
-                logger.info(f"Delta attributes: {dir(delta)}")
-                logger.info(f"Delta dict keys (if dict): {delta.keys() if isinstance(delta, dict) else 'N/A'}")
-                
-                # Check all possible thinking attribute names
-                thinking_attrs = []
-                if hasattr(delta, "thinking"):
-                    thinking_attrs.append("thinking")
-                if hasattr(delta, "thought"):
-                    thinking_attrs.append("thought")
-                if isinstance(delta, dict):
-                    if "thinking" in delta:
-                        thinking_attrs.append("dict.thinking")
-                    if "thought" in delta:
-                        thinking_attrs.append("dict.thought")
-                
-                logger.info(f"Found thinking attributes: {thinking_attrs}")
-                
-                # Try to get thinking content
-                thinking_content = None
-                if hasattr(delta, "thinking") and delta.thinking:
-                    thinking_content = delta.thinking
-                    logger.info(f"Found thinking via delta.thinking: {thinking_content[:100] if thinking_content else 'None'}")
-                elif isinstance(delta, dict) and "thinking" in delta and delta["thinking"]:
-                    thinking_content = delta["thinking"]
-                    logger.info(f"Found thinking via dict['thinking']: {thinking_content[:100] if thinking_content else 'None'}")
-                elif hasattr(delta, "thought") and delta.thought:
-                    thinking_content = delta.thought
-                    logger.info(f"Found thinking via delta.thought: {thinking_content[:100] if thinking_content else 'None'}")
-                elif isinstance(delta, dict) and "thought" in delta and delta["thought"]:
-                    thinking_content = delta["thought"]
-                    logger.info(f"Found thinking via dict['thought']: {thinking_content[:100] if thinking_content else 'None'}")
-                else:
-                    logger.info("No thinking content found in this chunk")
-            
-            # Check for native thinking chunks (Gemini 3 Pro)
-            has_thinking = False
-            thinking_content = None
-            
-            # Check multiple possible attribute names
-            if hasattr(delta, "thinking") and delta.thinking:
-                has_thinking = True
-                thinking_content = delta.thinking
-            elif isinstance(delta, dict) and "thinking" in delta and delta["thinking"]:
-                has_thinking = True
-                thinking_content = delta["thinking"]
-            elif hasattr(delta, "thought") and delta.thought:
-                has_thinking = True
-                thinking_content = delta.thought
-            elif isinstance(delta, dict) and "thought" in delta and delta["thought"]:
-                has_thinking = True
-                thinking_content = delta["thought"]
-            
-            # Yield thinking chunk if present
-            if has_thinking and thinking_content:
-                logger.info(f"Yielding thinking chunk ({len(thinking_content)} chars)")
-                yield {
-                    "type": "thinking",
-                    "content": thinking_content
-                }
-            
-            # Yield content chunk if present
-            if hasattr(delta, "content") and delta.content:
-                logger.info(f"Yielding content chunk ({len(delta.content)} chars)")
-                yield {
-                    "type": "content",
-                    "content": delta.content
-                }
-            elif isinstance(delta, dict) and "content" in delta and delta["content"]:
-                logger.info(f"Yielding content chunk ({len(delta['content'])} chars)")
-                yield {
-                    "type": "content",
-                    "content": delta["content"]
-                }
+            if chunk_type != "content":
+                if buffer:
+                    yield {"type": "content", "content": "".join(buffer)}
+                    buffer.clear()
+                yield {"type": chunk_type, "content": text}
+                continue
 
-        logger.info(f"Streaming complete. Total chunks processed: {chunk_count}")
+            buffer.append(text)
+            now = time.monotonic()
+            if len(buffer) >= _BATCH_N or now - last_flush >= batch_seconds:
+                yield {"type": "content", "content": "".join(buffer)}
+                buffer.clear()
+                last_flush = now
+
+        if buffer:
+            yield {"type": "content", "content": "".join(buffer)}
+    finally:
+        # Consumer went away mid-window: don't leave the read running
+        if next_delta is not None and not next_delta.done():
+            next_delta.cancel()
 
-    except Exception as e:
-        logger.error(f"LLM streaming error: {e}", exc_info=True)
-        yield {
-            "type": "content",
-            "content": f"\n\n[Error: {str(e)}]"
-        }
+
+async def generate_stream_frames(
+    messages: List[Dict[str, Any]],
+    model: str,
+    api_key: str,
+    frame_prefix: bytes,
+    frame_suffix: bytes,
+    temperature: float = 0.7,
+    max_tokens: int = 4000,
+) -> AsyncGenerator[Tuple[bytes, str], None]:
+    """
+    Generate streaming response as pre-encoded frames
+
+    Every chunk (thinking or content) is JSON-encoded as a string and wrapped in
+    frame_prefix/frame_suffix, so a caller relaying e.g. SSE frames needs no
+    per-chunk dict or serialization work of its own.
+
+    Args:
+        messages: List of message dicts with role and content
+        model: Model name
+        api_key: API key for the model provider
+        frame_prefix: Bytes preceding the JSON-encoded chunk text
+        frame_suffix: Bytes following the JSON-encoded chunk text
+        temperature: Randomness (0-1)
+        max_tokens: Maximum response length
+
+    Yields:
+        (frame bytes, raw chunk text)
+    """
+    async for _, text in _DeltaStream(messages, model, api_key, temperature, max_tokens):
+        yield frame_prefix + orjson.dumps(text) + frame_suffix, text
 
 
 async def generate_with_thinking(
@@ -485,9 +529,10 @@ async def generate_with_thinking(
     Models are instructed via THINKING_PROMPT to output <thinking>...</thinking> and <answer>...</answer> tags.
 
     Yields dicts with:
-    - section: "thinking" | "answer" | "error"
-    - content: chunk text (tags stripped)
-    - full: accumulated full text
+    - section: "thinking" | "answer" | "error" | "done"
+    - content: chunk text (tags stripped; "" for "done")
+    - full: raw full response text, only on the final "done"/"error" dict
+      (accumulated as a list and joined once instead of copied per chunk)
 
     Args:
         messages: Message list
@@ -499,7 +544,7 @@ async def generate_with_thinking(
     Yields:
         Dict with section info and content
     """
-    full_response = ""
+    full_parts: List[str] = []
 
     try:
         # Tag-based parsing for ALL models (unified approach)
@@ -513,7 +558,6 @@ async def generate_with_thinking(
                     yield {
                         "section": "thinking",
                         "content": chunk_dict["content"],
-                        "full": full_response,
                     }
                 continue
 
@@ -522,16 +566,13 @@ async def generate_with_thinking(
             if not chunk_content:
                 continue
 
-            full_response += chunk_content
+            full_parts.append(chunk_content)
             
             # Process chunk through state machine parser
             parsed_sections = parser.process_chunk(chunk_content)
             
-            # Yield each parsed section
-            for section in parsed_sections:
-                section_type = section["section"]
-                section_content = section["content"]
-                
+            # Yield each parsed section (the public dict is only built here)
+            for section_type, section_content in parsed_sections:
                 # Skip thinking if include_thinking is False
                 if section_type == "thinking" and not include_thinking:
                     continue
@@ -539,15 +580,11 @@ async def generate_with_thinking(
                 yield {
                     "section": section_type,
                     "content": section_content,
-                    "full": full_response,
                 }
         
         # Flush any remaining buffered content
         final_sections = parser.flush()
-        for section in final_sections:
-            section_type = section["section"]
-            section_content = section["content"]
-            
+        for section_type, section_content in final_sections:
             # Skip thinking if include_thinking is False
             if section_type == "thinking" and not include_thinking:
                 continue
@@ -555,13 +592,14 @@ async def generate_with_thinking(
             yield {
                 "section": section_type,
                 "content": section_content,
-                "full": full_response,
             }
 
+        yield {"section": "done", "content": "", "full": "".join(full_parts)}
+
     except Exception as e:
         logger.error(f"Thinking stream error: {e}", exc_info=True)
         yield {
             "section": "error",
             "content": f"\n\n[Error: {str(e)}]",
-            "full": full_response,
+            "full": "".join(full_parts),
         }
@@ -1,16 +1,23 @@
+import hashlib
 import logging
+import threading
+import uuid
+from collections import OrderedDict
 from typing import List, Optional, Dict, Any
 from pathlib import Path
 
 import chromadb
+import numpy as np
 from chromadb.config import Settings as ChromaSettings
 from sentence_transformers import SentenceTransformer
 
-from app.core.config import settings
+from app.core.config import get_embedder, get_settings
 
 
 logger = logging.getLogger(__name__)
 
+EMBEDDING_CACHE_SIZE = 1024
+
 
 class MemoryService:
     """
@@ -21,13 +28,16 @@ class MemoryService:
         self.collection: Optional[chromadb.Collection] = None
         self.embedder: Optional[SentenceTransformer] = None
         self.client: Optional[chromadb.ClientAPI] = None
+        # sha256(normalized text) -> read-only embedding, shared by every query-embedding caller
+        self._embedding_cache: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+        self._embedding_cache_lock = threading.Lock()
 
     def initialize(self) -> None:
         """Initialize ChromaDB and load embedding model"""
         try:
             # Initialize ChromaDB client
             self.client = chromadb.PersistentClient(
-                path=str(settings.memory_dir),
+                path=str(get_settings().memory_dir),
                 settings=ChromaSettings(anonymized_telemetry=False),
             )
 
@@ -38,14 +48,47 @@ class MemoryService:
             )
 
             # Load embedding model
-            logger.info(f"Loading embedding model: {settings.embedding_model}")
-            self.embedder = SentenceTransformer(settings.embedding_model)
+            logger.info(f"Loading embedding model: {get_settings().embedding_model}")
+            self.embedder = get_embedder()
             logger.info("Memory service initialized successfully")
 
         except Exception as e:
             logger.error(f"Failed to initialize memory service: {e}", exc_info=True)
             raise
 
+    def embed_query(self, text: str) -> np.ndarray:
+        """
+        Embed a query, reusing the vector of a recently embedded identical text
+
+        Safe to call from worker threads. The returned array is read-only.
+
+        Args:
+            text: Text to embed
+
+        Returns:
+            Embedding vector
+        """
+        if not self.embedder:
+            raise RuntimeError("Memory service not initialized")
+
+        # Keyed on whitespace-normalized text: the tokenizer splits on
+        # whitespace, so retries differing only in spacing embed identically
+        key = hashlib.sha256(" ".join(text.split()).encode("utf-8")).digest()
+        with self._embedding_cache_lock:
+            cached = self._embedding_cache.get(key)
+            if cached is not None:
+                self._embedding_cache.move_to_end(key)
+                return cached
+
+        embedding = self.embedder.encode(text)
+        embedding.setflags(write=False)
+
+        with self._embedding_cache_lock:
+            self._embedding_cache[key] = embedding
+            if len(self._embedding_cache) > EMBEDDING_CACHE_SIZE:
+                self._embedding_cache.popitem(last=False)
+        return embedding
+
     def add_memory(
         self, text: str, metadata: Optional[Dict[str, Any]] = None
     ) -> str:
@@ -59,26 +102,45 @@ class MemoryService:
         Returns:
             Memory ID (UUID string)
         """
+        return self.add_memories([text], [metadata] if metadata else None)[0]
+
+    def add_memories(
+        self,
+        texts: List[str],
+        metadatas: Optional[List[Optional[Dict[str, Any]]]] = None,
+    ) -> List[str]:
+        """
+        Add several memories with one batched encode and one collection write
+
+        Args:
+            texts: The texts to store
+            metadatas: Optional metadata dicts, one per text
+
+        Returns:
+            Memory IDs (UUID strings) in input order
+        """
         if not self.collection or not self.embedder:
             raise RuntimeError("Memory service not initialized")
+        if not texts:
+            return []
 
-        # Generate embedding
-        embedding = self.embedder.encode(text).tolist()
+        # Generate embeddings (one forward pass per batch instead of per text)
+        embeddings = self.embedder.encode(
+            texts, batch_size=32, convert_to_numpy=True, show_progress_bar=False
+        ).tolist()
 
-        # Generate ID
-        import uuid
-        memory_id = str(uuid.uuid4())
+        memory_ids = [str(uuid.uuid4()) for _ in texts]
 
         # Store in ChromaDB
         self.collection.add(
-            ids=[memory_id],
-            embeddings=[embedding],
-            documents=[text],
-            metadatas=[metadata] if metadata else [{}],
+            ids=memory_ids,
+            embeddings=embeddings,
+            documents=texts,
+            metadatas=[m or {} for m in metadatas] if metadatas else [{} for _ in texts],
         )
 
-        logger.debug(f"Added memory: {memory_id}")
-        return memory_id
+        logger.debug(f"Added {len(memory_ids)} memories: {', '.join(memory_ids)}")
+        return memory_ids
 
     def search_memory(self, query: str, n_results: int = 3) -> List[str]:
         """
@@ -97,7 +159,7 @@ class MemoryService:
 
         try:
             # Generate query embedding
-            query_embedding = self.embedder.encode(query).tolist()
+            query_embedding = self.embed_query(query).tolist()
 
             # Search ChromaDB
             results = self.collection.query(
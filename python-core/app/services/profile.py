@@ -1,11 +1,12 @@
+import asyncio
 import json
+import threading
 import uuid
 from pathlib import Path
 from datetime import datetime
 from typing import Optional, List
-from sentence_transformers import SentenceTransformer
 import numpy as np
-from app.core.config import settings
+from app.core.config import get_embedder, get_settings
 import logging
 
 logger = logging.getLogger(__name__)
@@ -17,15 +18,13 @@ class ProfileManager:
     """
     
     def __init__(self):
-        self.profile_path = settings.app_data_dir / "user_profile.json"
-        self.embedder = None  # Lazy load to avoid startup delay
+        self.profile_path = get_settings().app_data_dir / "user_profile.json"
+        self._write_lock = threading.Lock()  # Held by every load-modify-save (writes run on worker threads)
         self._ensure_profile_exists()
     
     def _get_embedder(self):
-        """Lazy load embedder on first use"""
-        if self.embedder is None:
-            self.embedder = SentenceTransformer('all-MiniLM-L6-v2')
-        return self.embedder
+        """Shared process-wide embedder (the same model instance memory uses)"""
+        return get_embedder()
     
     def _ensure_profile_exists(self):
         """Create empty profile if doesn't exist"""
@@ -67,25 +66,69 @@ class ProfileManager:
         Returns:
             entry_id
         """
-        profile = self._load()
-        
-        entry_id = f"mem_{uuid.uuid4().hex[:8]}"
-        entry = {
-            "id": entry_id,
+        return self.add_entries([{
             "category": category,
             "key": key,
             "value": value,
             "source": source,
-            "importance": max(0, min(10, importance)),  # Clamp 0-10
-            "timestamp": datetime.now().isoformat()
-        }
+            "importance": importance,
+        }])[0]
+    
+    def add_entries(self, items: List[dict], skip_existing: bool = False) -> List[Optional[str]]:
+        """
+        Add several memory entries with a single load/save of the profile
+        
+        Args:
+            items: Dicts with the add_entry fields (category, key, value,
+                   optional source and importance)
+            skip_existing: Skip items whose (category, key, value) is already
+                   stored (or earlier in items); checked against the profile
+                   on disk, so deleted entries can be added again
+        
+        Returns:
+            entry_ids in input order (None for skipped items)
+        """
+        if not items:
+            return []
         
-        profile["entries"].append(entry)
-        profile["metadata"]["total_entries"] = len(profile["entries"])
-        self._save(profile)
+        timestamp = datetime.now().isoformat()
+        entry_ids: List[Optional[str]] = []
         
-        logger.info(f"Added memory: {key} (importance={importance})")
-        return entry_id
+        with self._write_lock:
+            profile = self._load()
+            existing = (
+                {(e["category"], e["key"], e["value"]) for e in profile["entries"]}
+                if skip_existing else None
+            )
+            for item in items:
+                if existing is not None:
+                    signature = (item["category"], item["key"], item["value"])
+                    if signature in existing:
+                        entry_ids.append(None)
+                        continue
+                    existing.add(signature)
+                entry_id = f"mem_{uuid.uuid4().hex[:8]}"
+                importance = item.get("importance", 5)
+                profile["entries"].append({
+                    "id": entry_id,
+                    "category": item["category"],
+                    "key": item["key"],
+                    "value": item["value"],
+                    "source": item.get("source", "user_input"),
+                    "importance": max(0, min(10, importance)),  # Clamp 0-10
+                    "timestamp": timestamp
+                })
+                entry_ids.append(entry_id)
+                logger.info(f"Added memory: {item['key']} (importance={importance})")
+            
+            if any(entry_ids):
+                profile["metadata"]["total_entries"] = len(profile["entries"])
+                self._save(profile)
+        return entry_ids
+    
+    async def aadd_entries(self, items: List[dict], skip_existing: bool = False) -> List[Optional[str]]:
+        """add_entries on a worker thread so the file write doesn't block the event loop"""
+        return await asyncio.to_thread(self.add_entries, items, skip_existing)
     
     def get_all_entries(self, min_importance: int = 0) -> List[dict]:
         """Get all entries, optionally filtered by importance"""
@@ -99,31 +142,33 @@ class ProfileManager:
     
     def delete_entry(self, entry_id: str) -> bool:
         """Delete a memory entry"""
-        profile = self._load()
-        entries = profile["entries"]
-        
-        initial_count = len(entries)
-        profile["entries"] = [e for e in entries if e["id"] != entry_id]
-        
-        if len(profile["entries"]) < initial_count:
-            profile["metadata"]["total_entries"] = len(profile["entries"])
-            self._save(profile)
-            logger.info(f"Deleted memory: {entry_id}")
-            return True
+        with self._write_lock:
+            profile = self._load()
+            entries = profile["entries"]
+            
+            initial_count = len(entries)
+            profile["entries"] = [e for e in entries if e["id"] != entry_id]
+            
+            if len(profile["entries"]) < initial_count:
+                profile["metadata"]["total_entries"] = len(profile["entries"])
+                self._save(profile)
+                logger.info(f"Deleted memory: {entry_id}")
+                return True
         
         return False
     
     def update_entry(self, entry_id: str, new_value: str) -> bool:
         """Update a memory's value"""
-        profile = self._load()
-        
-        for entry in profile["entries"]:
-            if entry["id"] == entry_id:
-                entry["value"] = new_value
-                entry["last_modified"] = datetime.now().isoformat()
-                self._save(profile)
-                logger.info(f"Updated memory: {entry_id}")
-                return True
+        with self._write_lock:
+            profile = self._load()
+            
+            for entry in profile["entries"]:
+                if entry["id"] == entry_id:
+                    entry["value"] = new_value
+                    entry["last_modified"] = datetime.now().isoformat()
+                    self._save(profile)
+                    logger.info(f"Updated memory: {entry_id}")
+                    return True
         
         return False
     
@@ -199,14 +244,15 @@ class ProfileManager:
     
     def clear_all(self) -> bool:
         """Nuclear option: delete all memories"""
-        self._save({
-            "entries": [],
-            "metadata": {
-                "created": datetime.now().isoformat(),
-                "total_entries": 0,
-                "last_cleared": datetime.now().isoformat()
-            }
-        })
+        with self._write_lock:
+            self._save({
+                "entries": [],
+                "metadata": {
+                    "created": datetime.now().isoformat(),
+                    "total_entries": 0,
+                    "last_cleared": datetime.now().isoformat()
+                }
+            })
         logger.warning("ALL MEMORIES CLEARED")
         return True
     
@@ -2,12 +2,64 @@ import logging
 
 import litellm
 
-from app.core.prompts import ROUTER_PROMPT, QueryType
+from app.core.prompts import QUERY_TYPES, QueryType, render_router_prompt
 
 
 logger = logging.getLogger(__name__)
 
 
+async def request_classification(query: str, api_key: str) -> QueryType:
+    """
+    Ask the router model to classify a query
+
+    Unlike classify_query, errors are propagated so callers can tell a real
+    classification apart from the error fallback (e.g. to avoid caching it).
+
+    Args:
+        query: User's input text
+        api_key: API key for the router model (Gemini)
+
+    Returns:
+        QueryType: SIMPLE | FACTUAL | COMPLEX
+    """
+    prompt = render_router_prompt(query=query)
+
+    response = await litellm.acompletion(
+        model="gemini-2.0-flash",  # No prefix - routes to Gemini API
+        messages=[
+            {
+                "role": "system",
+                "content": "You are a query classifier. Respond with ONLY one word: simple, factual, or complex."
+            },
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ],
+        api_key=api_key,
+        custom_llm_provider="gemini",  # Explicit provider - forces Gemini API
+        temperature=0,  # Deterministic classification
+        max_tokens=50,
+    )
+
+    result = response.choices[0].message.content.strip().lower()
+
+    # Validate result: exact one-word answer first, then a substring search
+    query_type = QUERY_TYPES.get(result)
+    if query_type is not None:
+        logger.info(f"Query classified as: {result}")
+        return query_type
+    if "simple" in result:
+        logger.info("Query classified as: simple")
+        return QueryType.SIMPLE
+    elif "factual" in result:
+        logger.info("Query classified as: factual")
+        return QueryType.FACTUAL
+    else:
+        logger.info("Query classified as: complex (default)")
+        return QueryType.COMPLEX  # Safe default
+
+
 async def classify_query(query: str, api_key: str) -> QueryType:
     """
     Classify user query as simple/factual/complex using Gemini model
@@ -22,42 +74,10 @@ async def classify_query(query: str, api_key: str) -> QueryType:
         api_key: API key for the router model (Gemini)
 
     Returns:
-        QueryType: "simple" | "factual" | "complex"
+        QueryType: SIMPLE | FACTUAL | COMPLEX
     """
     try:
-        prompt = ROUTER_PROMPT.format(query=query)
-
-        response = await litellm.acompletion(
-            model="gemini-2.0-flash",  # No prefix - routes to Gemini API
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a query classifier. Respond with ONLY one word: simple, factual, or complex."
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            api_key=api_key,
-            custom_llm_provider="gemini",  # Explicit provider - forces Gemini API
-            temperature=0,  # Deterministic classification
-            max_tokens=50,
-        )
-
-        result = response.choices[0].message.content.strip().lower()
-
-        # Validate result
-        if "simple" in result:
-            logger.info("Query classified as: simple")
-            return "simple"  # type: ignore[return-value]
-        elif "factual" in result:
-            logger.info("Query classified as: factual")
-            return "factual"  # type: ignore[return-value]
-        else:
-            logger.info("Query classified as: complex (default)")
-            return "complex"  # Safe default
-
+        return await request_classification(query, api_key)
     except Exception as e:
         logger.error(f"Classification failed: {e}, defaulting to 'complex'")
-        return "complex"  # Safe default on error
+        return QueryType.COMPLEX  # Safe default on error
@@ -1,6 +1,6 @@
 import logging
 from typing import Optional
-from app.core.config import settings
+from app.core.config import get_settings
 
 logger = logging.getLogger(__name__)
 
@@ -11,10 +11,10 @@ class ToolsService:
     
     def _initialize_client(self):
         """Initialize Tavily client if key is available"""
-        if settings.tavily_api_key:
+        if get_settings().tavily_api_key:
             try:
                 from tavily import TavilyClient
-                self.tavily_client = TavilyClient(api_key=settings.tavily_api_key)
+                self.tavily_client = TavilyClient(api_key=get_settings().tavily_api_key)
                 logger.info("Tavily client initialized successfully")
             except Exception as e:
                 logger.error(f"Failed to initialize Tavily client: {e}")
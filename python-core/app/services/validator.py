@@ -1,16 +1,18 @@
 import logging
 import re
 
+from app.core.prompts import QueryType
+
 logger = logging.getLogger(__name__)
 
 
-async def validate_response(response: str, query_type: str) -> dict:
+async def validate_response(response: str, query_type: QueryType) -> dict:
     """
     Validate AI response based on query type
 
     Args:
         response: The AI-generated response text
-        query_type: "simple" | "factual" | "complex"
+        query_type: Router classification
 
     Returns:
         Dict with validation results:
@@ -33,7 +35,7 @@ async def validate_response(response: str, query_type: str) -> dict:
         }
 
     # Code validation for complex queries
-    if query_type == "complex":
+    if query_type is QueryType.COMPLEX:
         # Check for code blocks
         code_blocks = re.findall(r"```[\s\S]*?```", response)
         if code_blocks:
@@ -48,7 +50,7 @@ async def validate_response(response: str, query_type: str) -> dict:
                     warnings.append("Possible syntax error: Unmatched braces in code block")
 
     # Math validation (basic)
-    if query_type == "complex":
+    if query_type is QueryType.COMPLEX:
         # Check for mathematical expressions
         math_patterns = re.findall(r"\d+\s*[+\-*/]\s*\d+", response)
         if math_patterns:
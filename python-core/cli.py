@@ -28,8 +28,8 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 from app.services.llm import generate_with_thinking
 from app.services.router import classify_query
 from app.services.tools import tools
-from app.core.config import settings, MODEL_TIERS
-from app.core.prompts import THINKING_PROMPT, CONTEXT_TEMPLATE
+from app.core.config import get_settings, MODEL_TIERS
+from app.core.prompts import CONTEXT_TEMPLATE, QueryType, reasoning_prompt
 
 # Initialize Typer and Console
 console = Console()
@@ -91,8 +91,8 @@ async def get_api_key_from_env_or_config(model: str) -> str:
         sys.exit(1)
     return key
 
-async def chat_loop(model: str = None, ask: str = None):
-    """Main chat loop"""
+async def chat_loop(model: str = None, ask: str = None, api_key: str = None):
+    """Main chat loop (api_key overrides the key from the environment)"""
     # Only print header if interactive
     if not ask:
         print_header()
@@ -108,7 +108,8 @@ async def chat_loop(model: str = None, ask: str = None):
         console.print(f"[{COLOR_THINKING}]Type 'exit' to quit, '/clear' to reset context[/{COLOR_THINKING}]\n")
     
     history = []
-    api_key = await get_api_key_from_env_or_config(model)
+    if not api_key:
+        api_key = await get_api_key_from_env_or_config(model)
 
     # One-off run logic
     first_run = True if ask else False
@@ -141,7 +142,7 @@ async def chat_loop(model: str = None, ask: str = None):
             history.append({"role": "user", "content": user_input})
             
             # --- INTELLIGENCE LAYER: Classification & Search ---
-            query_type = "complex" # Default
+            query_type = QueryType.COMPLEX # Default
             search_context = ""
             
             # Create a status spinner for pre-computation
@@ -150,7 +151,7 @@ async def chat_loop(model: str = None, ask: str = None):
                     # Classify query
                     query_type = await classify_query(user_input, api_key)
                     
-                    if query_type == "factual":
+                    if query_type is QueryType.FACTUAL:
                         status.update(f"[{COLOR_SECONDARY}]Searching web...[/{COLOR_SECONDARY}]")
                         # Run search in thread
                         tools._initialize_client() 
@@ -165,7 +166,7 @@ async def chat_loop(model: str = None, ask: str = None):
 
             # --- DYNAMIC MODEL SELECTION (Auto Mode) ---
             if model == "auto":
-                if query_type == "complex":
+                if query_type is QueryType.COMPLEX:
                     current_model = MODEL_TIERS["pro"]
                 else:
                     current_model = MODEL_TIERS["fast"]
@@ -179,7 +180,7 @@ async def chat_loop(model: str = None, ask: str = None):
             if is_deepseek or is_flash:
                 system_prompt = "You are a helpful AI assistant."
             else:
-                system_prompt = THINKING_PROMPT # Force Gemini Pro to think
+                system_prompt = reasoning_prompt(QueryType.COMPLEX) # Force Gemini Pro to think
 
             # Inject search context if available
             if search_context:
@@ -227,6 +228,9 @@ async def chat_loop(model: str = None, ask: str = None):
                     section = chunk.get("section")
                     content = chunk.get("content")
                     
+                    if section == "done":
+                        continue
+                    
                     if section == "thinking":
                         thinking_buffer += content
                         
@@ -317,10 +321,9 @@ def main(
     """
     Start the Sigma Agent CLI.
     """
-    if key:
-        os.environ["GEMINI_API_KEY"] = key
-        
-    asyncio.run(chat_loop(model, ask))
+    # The override is passed down explicitly (LiteLLM gets it per call via
+    # api_key=) instead of being written into the process environment
+    asyncio.run(chat_loop(model, ask, api_key=key))
 
 if __name__ == "__main__":
     app()
\ No newline at end of file